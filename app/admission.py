@@ -0,0 +1,197 @@
+'''Per-route admission control shedding excess requests with Retry-After'''
+import os
+import functools
+import threading
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge
+from app.config import WORKER_THREADS
+from app.updates import MAX_STREAMS
+
+def route_limits(route, concurrency, queue):
+    '''Read the concurrency and wait queue limits of a route from the environment'''
+    prefix = f"ADMISSION_{route.upper()}"
+    return (int(os.environ.get(f"{prefix}_CONCURRENCY", concurrency)),
+            int(os.environ.get(f"{prefix}_QUEUE", queue)))
+
+# Admitted and queued requests each hold a Gunicorn thread, so the defaults leave
+# PROBE_THREADS threads free for /version and /metrics; past the limits requests are
+# shed here instead of piling up in the unbounded gthread queue
+PROBE_THREADS = 1
+# Threads left for /temperature once streams, probes, /store and /readyz have theirs
+TEMPERATURE_THREADS = max(WORKER_THREADS - MAX_STREAMS - PROBE_THREADS - 2, 1)
+
+# Limits apply per worker process. The temperature limit only covers cache misses,
+# which wait for the one upstream refresh of the process.
+ROUTE_LIMITS = {
+    "temperature": route_limits("temperature", TEMPERATURE_THREADS - TEMPERATURE_THREADS // 2,
+                                TEMPERATURE_THREADS // 2),
+    "store": route_limits("store", 1, 0),
+    "readyz": route_limits("readyz", 1, 0),
+}
+QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 10))
+RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', 30))
+
+SHED_REQUESTS = Counter(
+    'hivebox_requests_shed_total',
+    'Requests rejected by admission control',
+    ['route', 'reason']
+)
+STALE_RESPONSES = Counter(
+    'hivebox_requests_served_stale_total',
+    'Shed requests answered with stale data',
+    ['route']
+)
+# Summed over the live workers in multiprocess mode
+IN_FLIGHT = Gauge('hivebox_requests_in_flight', 'Requests being processed', ['route'],
+                  multiprocess_mode='livesum')
+QUEUED = Gauge('hivebox_requests_queued', 'Requests waiting for a slot', ['route'],
+               multiprocess_mode='livesum')
+
+class Shed(Exception):
+    '''Raised when admission control rejects the work a request needs'''
+
+    def __init__(self, route):
+        super().__init__(f"{route} shed by admission control")
+        self.route = route
+
+def shed_response():
+    '''Fast 503 telling the client when to come back'''
+    return {"error": "Server overloaded, retry later"}, 503, {"Retry-After": str(RETRY_AFTER)}
+
+class BaseLimiter:  # pylint: disable=too-few-public-methods
+    '''Wait queue and metric bookkeeping shared by the sync and async limiters'''
+
+    def __init__(self, route, queue, timeout):
+        self.route = route
+        self.queue = queue
+        self.timeout = timeout
+        self._waiting = 0
+        self._slots = None
+
+    def _join_queue(self):
+        '''Count a new waiter, or shed it if the queue is full'''
+        if self._waiting >= self.queue:
+            SHED_REQUESTS.labels(self.route, 'queue_full').inc()
+            return False
+        self._waiting += 1
+        QUEUED.labels(self.route).inc()
+        return True
+
+    def _leave_queue(self):
+        self._waiting -= 1
+        QUEUED.labels(self.route).dec()
+
+    def _admit(self, admitted):
+        '''Record the outcome of waiting for a slot'''
+        if not admitted:
+            SHED_REQUESTS.labels(self.route, 'timeout').inc()
+            return False
+        IN_FLIGHT.labels(self.route).inc()
+        return True
+
+    def release(self):
+        '''Give the slot back'''
+        IN_FLIGHT.labels(self.route).dec()
+        self._slots.release()
+
+class Limiter(BaseLimiter):
+    '''Bound the concurrent requests of a route, with a bounded queue of waiters'''
+
+    def __init__(self, route, concurrency, queue, timeout=QUEUE_TIMEOUT):
+        super().__init__(route, queue, timeout)
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        '''Take a slot, waiting in the queue if there is room; False if shed'''
+        if self._slots.acquire(blocking=False):  # pylint: disable=consider-using-with
+            return self._admit(True)
+
+        with self._lock:
+            if not self._join_queue():
+                return False
+        try:
+            admitted = self._slots.acquire(timeout=self.timeout)  # pylint: disable=consider-using-with
+        finally:
+            with self._lock:
+                self._leave_queue()
+        return self._admit(admitted)
+
+class SingleFlight:  # pylint: disable=too-few-public-methods
+    '''Run one call at a time and hand its outcome to every thread asking meanwhile'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flight = None
+
+    def run(self, func):
+        '''Return func(), sharing the call already in flight if there is one'''
+        with self._lock:
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = {"done": threading.Event()}
+
+        if not leader:
+            flight["done"].wait()
+            if "error" in flight:
+                raise flight["error"]
+            return flight["result"]
+
+        try:
+            flight["result"] = func()
+            return flight["result"]
+        except Exception as e:
+            flight["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._flight = None
+            flight["done"].set()
+
+def fallback_or_shed(route, response):
+    '''Answer a shed request with its fallback response, or a 503 without one'''
+    if response is None:
+        return shed_response()
+    STALE_RESPONSES.labels(route).inc()
+    return response
+
+LIMITERS = {route: Limiter(route, *limits) for route, limits in ROUTE_LIMITS.items()}
+
+@contextmanager
+def admit(route):
+    '''Hold a slot of route for the block, raising Shed when there is none'''
+    limiter = LIMITERS[route]
+    if not limiter.acquire():
+        raise Shed(route)
+    try:
+        yield
+    finally:
+        limiter.release()
+
+def on_shed(fallback=None):
+    '''Decorate a view so work shed inside it gets fallback() when that returns a
+    response, else a 503'''
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                return view(*args, **kwargs)
+            except Shed as e:
+                return fallback_or_shed(e.route, fallback() if fallback is not None else None)
+        return wrapper
+    return decorator
+
+def limit(route, fallback=None):
+    '''Decorate a view with the limiter of route.
+
+    Shed requests get fallback() when it returns a response, else a 503.
+    '''
+    def decorator(view):
+        @on_shed(fallback)
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with admit(route):
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
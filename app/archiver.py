@@ -0,0 +1,182 @@
+'''Optional in-process archiver storing the cached snapshot, run by one elected replica'''
+import os
+import time
+import uuid
+import socket
+import threading
+import redis
+from prometheus_client import Counter, Gauge
+from app.config import create_redis_client
+from app import storage
+
+ARCHIVER_ENABLED = os.environ.get('ARCHIVER_ENABLED', 'false').lower() == 'true'
+ARCHIVE_INTERVAL = int(os.environ.get('ARCHIVE_INTERVAL', 300))
+# A leader that stops renewing is replaced once its lease expires
+LEASE_TTL = int(os.environ.get('ARCHIVER_LEASE_TTL', 30))
+RECONNECT_DELAY = 5
+
+LEADER_KEY = "archiver_leader"
+LAST_ARCHIVED_KEY = "archiver_last_archived"
+
+# Only touch the lease while this process still owns it
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+# Record an archived snapshot, never moving the mark back to an older one, e.g.
+# when a leader that lost its lease mid-upload finishes after its successor
+MARK_SCRIPT = """
+local last = tonumber(redis.call('get', KEYS[1]))
+if last == nil or tonumber(ARGV[1]) > last then
+    redis.call('set', KEYS[1], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+ARCHIVES = Counter(
+    'hivebox_archives_total',
+    'Scheduled archive runs of the cached snapshot',
+    ['outcome']
+)
+# 1 in multiprocess mode while any live worker of the pod leads
+LEADER = Gauge('hivebox_archiver_leader', '1 while this process holds the archiver lease',
+               multiprocess_mode='livemax')
+
+class Archiver:
+    '''Archive the cached snapshot every interval while holding the Redis leader lease'''
+
+    def __init__(self, interval=ARCHIVE_INTERVAL, lease_ttl=LEASE_TTL):
+        self.interval = interval
+        self.lease_ttl = lease_ttl
+        self.identity = None
+        self.redis_client = None
+        self._last_run = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        '''Start the scheduler thread of this process if it is not running'''
+        if self._thread is None or not self._thread.is_alive():
+            # Taken here rather than at import so preloaded workers differ
+            self.identity = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        '''Stop the scheduler and hand the lease over right away'''
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=RECONNECT_DELAY)
+        if self.redis_client is not None:
+            try:
+                self.redis_client.eval(RELEASE_SCRIPT, 1, LEADER_KEY, self.identity)
+            except redis.RedisError as e:
+                print(f"Redis error while releasing archiver lease: {e}")
+        LEADER.set(0)
+
+    def hold_lease(self):
+        '''Take the lease if it is free or renew it if it is ours; True while leader'''
+        leader = bool(
+            self.redis_client.set(LEADER_KEY, self.identity, nx=True, ex=self.lease_ttl)
+            or self.redis_client.eval(RENEW_SCRIPT, 1, LEADER_KEY, self.identity, self.lease_ttl)
+        )
+        LEADER.set(1 if leader else 0)
+        return leader
+
+    def upload(self, result, updated_at):
+        '''Upload a snapshot, renewing the lease meanwhile so a slow upload keeps it'''
+        done = threading.Event()
+
+        def renew():
+            while not done.wait(self.lease_ttl / 3):
+                try:
+                    self.hold_lease()
+                except redis.RedisError as e:
+                    print(f"Redis error while renewing archiver lease: {e}")
+
+        renewer = threading.Thread(target=renew, daemon=True)
+        renewer.start()
+        try:
+            return storage.store_temperature_data(result, updated_at)
+        finally:
+            done.set()
+            renewer.join()
+
+    def archive_snapshot(self):
+        '''Store the cached snapshot unless it is missing or already archived'''
+        pipe = self.redis_client.pipeline()
+        pipe.get("temperature_data")
+        pipe.get("temperature_updated")
+        pipe.get(LAST_ARCHIVED_KEY)
+        result, updated_at, last_archived = pipe.execute()
+
+        if (result is None or updated_at is None
+                or (last_archived is not None and int(updated_at) <= int(last_archived))):
+            print("No new cached snapshot to archive.")
+            ARCHIVES.labels('skipped').inc()
+            return None
+
+        try:
+            message = self.upload(result, updated_at)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # e.g. urllib3 errors while MinIO is unreachable, retried on the next tick
+            message = f"Archive upload failed: {e}\n"
+        if not message.startswith("Temperature data successfully uploaded"):
+            ARCHIVES.labels('failed').inc()
+            return message
+
+        # Recorded even if the lease was lost meanwhile, the upload did happen
+        self.redis_client.eval(MARK_SCRIPT, 1, LAST_ARCHIVED_KEY, updated_at)
+        ARCHIVES.labels('stored').inc()
+        return message
+
+    def tick(self, now=None):
+        '''Renew the lease and archive when leader and the interval has passed'''
+        now = time.time() if now is None else now
+        if not self.hold_lease() or now - self._last_run < self.interval:
+            return None
+
+        self._last_run = now
+        return self.archive_snapshot()
+
+    def _run(self):
+        '''Tick often enough to renew the lease, reconnecting after Redis errors'''
+        while not self._stop.is_set():
+            self.redis_client, available = create_redis_client()
+            if not available:
+                self._stop.wait(RECONNECT_DELAY)
+                continue
+
+            try:
+                while not self._stop.is_set():
+                    message = self.tick()
+                    if message:
+                        print(f"Archiver: {message.strip()}")
+                    self._stop.wait(self.lease_ttl / 3)
+            except redis.RedisError as e:
+                print(f"Redis error in archiver: {e}")
+                LEADER.set(0)
+                self.redis_client.close()
+                self._stop.wait(RECONNECT_DELAY)
+
+ARCHIVER = Archiver()
+
+def start():
+    '''Start the archiver of this process; does nothing unless ARCHIVER_ENABLED'''
+    if ARCHIVER_ENABLED:
+        ARCHIVER.start()
+
+def stop():
+    '''Stop the archiver of this process if it was started'''
+    if ARCHIVER_ENABLED:
+        ARCHIVER.stop()
@@ -0,0 +1,122 @@
+'''ASGI variant of the app serving the routes of main.py with non-blocking I/O.'''
+import socket
+import asyncio
+from quart import Quart, Response, request
+from prometheus_client import CONTENT_TYPE_LATEST
+from app import async_opensense
+from app import async_readiness
+from app import storage
+from app import readiness
+from app import http_cache
+from app import async_admission
+from app import async_updates
+from app import async_boxes
+from app import async_sketches
+from app import archiver
+from app import exposition
+from app.sketches import DEFAULT_WINDOW, DEFAULT_QUANTILES
+from app.boxes import BOX_STALE_MINUTES
+from app.updates import STREAM_HEADERS, initial_event
+from app.admission import Shed
+from app.config import APP_VERSION
+
+app = Quart(__name__)
+
+HOSTNAME = socket.gethostname()
+IPADDR = socket.gethostbyname(HOSTNAME)
+
+@app.before_serving
+async def start_archiver():
+    '''Start the scheduled archiver of this worker when enabled.'''
+    archiver.start()
+
+@app.after_serving
+async def close_clients():
+    '''Stop the archiver and close the shared Redis and HTTP clients on shutdown.'''
+    await asyncio.to_thread(archiver.stop)
+    await async_opensense.close_clients()
+
+@app.route('/version')
+async def print_version():
+    '''Function printing the current version of the app.'''
+    return f"Current app version: {APP_VERSION}\n"
+
+async def stale_temperature():
+    '''Last known temperature, answered to requests shed by admission control.'''
+    result = await async_opensense.stale_result()
+    if result is None:
+        return None
+    return result + f"From: {IPADDR}\n", http_cache.STALE_HEADERS
+
+async def last_readiness():
+    '''Last readiness result, answered to probes shed by admission control.'''
+    return readiness.readyz_response(readiness.last_status())
+
+@app.route('/temperature')
+@async_admission.on_shed(fallback=stale_temperature)
+async def get_temperature():
+    '''Function to get the current temperature.'''
+    result, _, snapshot = await async_opensense.get_snapshot()
+    headers = http_cache.snapshot_headers(snapshot)
+
+    if http_cache.not_modified(request.headers, headers):
+        return "", 304, headers
+
+    return result + f"From: {IPADDR}\n", headers
+
+@app.route('/temperature/stream')
+async def temperature_stream():
+    '''Server-Sent Events stream pushing every new temperature snapshot.'''
+    try:
+        initial = initial_event(*await async_opensense.get_snapshot())
+    except Shed:
+        # The stream still gets the snapshot of the refresh under way
+        initial = None
+
+    response = Response(async_updates.stream_events(initial),
+                        mimetype="text/event-stream",
+                        headers=STREAM_HEADERS)
+    # Streams stay open indefinitely
+    response.timeout = None
+    return response
+
+@app.route('/temperature/quantiles')
+async def temperature_quantiles():
+    '''Temperature quantiles over a time window, merged from the per-refresh sketches.'''
+    return await async_sketches.quantiles(request.args.get('window', DEFAULT_WINDOW),
+                                          request.args.get('q', DEFAULT_QUANTILES))
+
+@app.route('/boxes/health')
+async def boxes_health():
+    '''Reachability of sensor boxes from the last-seen index, without upstream calls.'''
+    stale_minutes = request.args.get('stale_minutes', BOX_STALE_MINUTES, type=int)
+    return await async_boxes.health(stale_minutes)
+
+@app.route('/boxes/<box_id>')
+async def box_status(box_id):
+    '''Last-seen status of a single sensor box.'''
+    stale_minutes = request.args.get('stale_minutes', BOX_STALE_MINUTES, type=int)
+    return await async_boxes.status(box_id, stale_minutes)
+
+@app.route('/metrics')
+async def metrics():
+    '''Function to return Prometheus metrics.'''
+    # Merging the files of every worker reads from disk
+    return Response(await asyncio.to_thread(exposition.latest), mimetype=CONTENT_TYPE_LATEST)
+
+@app.route('/store')
+@async_admission.limit('store')
+async def store():
+    '''Function to store results in MinIO.'''
+    result, _, snapshot = await async_opensense.get_snapshot()
+    updated_at = snapshot[0] if snapshot else None
+    # The MinIO client is blocking, keep it off the event loop
+    return await asyncio.to_thread(storage.store_temperature_data, result, updated_at)
+
+@app.route('/readyz')
+@async_admission.limit('readyz', fallback=last_readiness)
+async def readyz():
+    '''Readiness probe endpoint'''
+    status_code = await async_readiness.readiness_check()
+
+    return readiness.readyz_response(status_code)
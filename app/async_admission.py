@@ -0,0 +1,91 @@
+'''Asyncio counterpart of the admission module used by the ASGI app'''
+import asyncio
+import functools
+from contextlib import asynccontextmanager
+from app.admission import (QUEUE_TIMEOUT, BaseLimiter, Shed, fallback_or_shed,
+                           route_limits)
+
+# Waiting coroutines hold no threads, so these limits do not follow GUNICORN_THREADS.
+# Cache misses share one refresh, so thousands of them can wait for it.
+ROUTE_LIMITS = {
+    "temperature": route_limits("temperature", 1000, 100),
+    "store": route_limits("store", 1, 0),
+    "readyz": route_limits("readyz", 1, 0),
+}
+
+class AsyncLimiter(BaseLimiter):
+    '''Bound the concurrent requests of a route, with a bounded queue of waiters'''
+
+    def __init__(self, route, concurrency, queue, timeout=QUEUE_TIMEOUT):
+        super().__init__(route, queue, timeout)
+        self._slots = asyncio.Semaphore(concurrency)
+
+    async def acquire(self):
+        '''Take a slot, waiting in the queue if there is room; False if shed'''
+        if not self._slots.locked():
+            await self._slots.acquire()
+            return self._admit(True)
+
+        if not self._join_queue():
+            return False
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+            admitted = True
+        except asyncio.TimeoutError:
+            admitted = False
+        finally:
+            self._leave_queue()
+        return self._admit(admitted)
+
+class AsyncSingleFlight:  # pylint: disable=too-few-public-methods
+    '''Run one coroutine at a time and hand its outcome to every task asking meanwhile'''
+
+    def __init__(self):
+        self._task = None
+
+    async def run(self, func):
+        '''Return await func(), sharing the call already in flight if there is one'''
+        task = self._task
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            task = self._task = asyncio.ensure_future(func())
+        # A client going away must not cancel the call the others are waiting for
+        return await asyncio.shield(task)
+
+LIMITERS = {route: AsyncLimiter(route, *limits) for route, limits in ROUTE_LIMITS.items()}
+
+@asynccontextmanager
+async def admit(route):
+    '''Hold a slot of route for the block, raising Shed when there is none'''
+    limiter = LIMITERS[route]
+    if not await limiter.acquire():
+        raise Shed(route)
+    try:
+        yield limiter
+    finally:
+        limiter.release()
+
+def on_shed(fallback=None):
+    '''Decorate an async view so work shed inside it gets await fallback() when that
+    returns a response, else a 503'''
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await view(*args, **kwargs)
+            except Shed as e:
+                route = e.route
+            return fallback_or_shed(route, await fallback() if fallback is not None else None)
+        return wrapper
+    return decorator
+
+def limit(route, fallback=None):
+    '''Decorate an async view with the limiter of route.
+
+    Shed requests get await fallback() when it returns a response, else a 503.
+    '''
+    def decorator(view):
+        async def admitted(*args, **kwargs):
+            async with admit(route):
+                return await view(*args, **kwargs)
+        return on_shed(fallback)(functools.wraps(view)(admitted))
+    return decorator
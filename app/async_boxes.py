@@ -0,0 +1,26 @@
+'''Asyncio counterpart of the boxes module used by the ASGI app'''
+import redis
+from app import async_opensense
+from app.boxes import (BOX_INDEX_KEY, BOX_STALE_MINUTES, UNAVAILABLE, box_status,
+                       health_summary, queue_health_queries)
+
+async def health(stale_minutes=BOX_STALE_MINUTES):
+    '''Reachability of the indexed boxes as a (body, status code) pair'''
+    try:
+        pipe = queue_health_queries(async_opensense.get_redis_client().pipeline(), stale_minutes)
+        results = await pipe.execute()
+    except redis.RedisError as e:
+        print(f"Redis error while reading box index: {e}")
+        return UNAVAILABLE
+
+    return health_summary(results, stale_minutes), 200
+
+async def status(box_id, stale_minutes=BOX_STALE_MINUTES):
+    '''Last-seen status of one box as a (body, status code) pair'''
+    try:
+        score = await async_opensense.get_redis_client().zscore(BOX_INDEX_KEY, box_id)
+    except redis.RedisError as e:
+        print(f"Redis error while reading box index: {e}")
+        return UNAVAILABLE
+
+    return box_status(box_id, score, stale_minutes)
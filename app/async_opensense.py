@@ -0,0 +1,140 @@
+'''Asyncio counterpart of the opensense module used by the ASGI app'''
+import time
+import httpx
+import redis
+from app import opensense
+from app import boxes
+from app import sketches
+from app import async_admission
+from app.config import create_async_redis_client, CACHE_TTL
+
+# Created lazily so they bind to the event loop of the serving worker
+_clients = {"redis": None, "http": None}
+# Concurrent cache misses of this process wait for one upstream refresh
+REFRESH = async_admission.AsyncSingleFlight()
+
+def get_redis_client():
+    '''Return the shared asyncio Redis client, creating it on first use'''
+    if _clients["redis"] is None:
+        _clients["redis"] = create_async_redis_client()
+    return _clients["redis"]
+
+def get_http_client():
+    '''Return the shared HTTP client, creating it on first use'''
+    if _clients["http"] is None or _clients["http"].is_closed:
+        _clients["http"] = httpx.AsyncClient(timeout=httpx.Timeout(60, connect=180))
+    return _clients["http"]
+
+async def close_clients():
+    '''Close the shared clients when the server shuts down'''
+    if _clients["http"] is not None:
+        await _clients["http"].aclose()
+        _clients["http"] = None
+    if _clients["redis"] is not None:
+        await _clients["redis"].aclose()
+        _clients["redis"] = None
+
+async def stale_result():
+    '''Return the last computed result even if its cache entry expired, or None.'''
+    try:
+        return await get_redis_client().get("temperature_data_stale")
+    except redis.RedisError as e:
+        print(f"Redis error: {e}. Stale data unavailable.")
+        return None
+
+async def _download():
+    '''Stream the boxes from OpenSenseMap up to the size limit'''
+    downloaded = 0
+    chunks = []
+    truncated = False
+
+    async with get_http_client().stream(
+        "GET",
+        opensense.OPENSENSE_URL,
+        params=opensense.request_params()
+    ) as response:
+        response.raise_for_status()
+
+        async for chunk in response.aiter_bytes(chunk_size=opensense.CHUNK_SIZE):
+            chunks.append(chunk)
+            downloaded += len(chunk)
+            if downloaded >= opensense.MAX_BYTES:
+                print(f"Reached {opensense.MAX_MB} MB limit ({downloaded:,} bytes), "
+                      "stopping download")
+                truncated = True
+                break
+
+        encoding = response.encoding
+
+    print(f'Bytes downloaded: {downloaded:,}')
+    print('Data retrieved successfully!' + (" (partial)" if truncated else ""))
+
+    return opensense.parse_body(chunks, encoding, truncated)
+
+async def get_temperature():
+    '''Function to get the average temperature from OpenSenseMap API without blocking.'''
+    result, stats, _ = await get_snapshot()
+    return result, stats
+
+async def get_snapshot():
+    '''Return (result, stats, snapshot info), reading body, timestamp and TTL together.
+
+    Only cache misses go through admission control, which raises admission.Shed
+    when too many of them are already waiting.
+    '''
+    cached = await read_snapshot()
+    if cached is not None:
+        return cached
+
+    async with async_admission.admit('temperature'):
+        return await REFRESH.run(refresh_snapshot)
+
+async def read_snapshot():
+    '''Return the cached (result, stats, snapshot info), or None on a cache miss.'''
+    try:
+        values = await opensense.queue_snapshot_read(get_redis_client().pipeline()).execute()
+    except redis.RedisError as e:
+        print(f"Redis error: {e}. Proceeding without cache.")
+        return None
+    return opensense.cache_hit(values)
+
+async def refresh_snapshot():
+    '''Fetch, summarize and cache a new snapshot, as (result, stats, snapshot info).'''
+    # The refresh this one waited for may have just filled the cache
+    cached = await read_snapshot()
+    if cached is not None:
+        return cached
+
+    print("Fetching new data from OpenSenseMap API...")
+
+    try:
+        data = await _download()
+        if data is None:
+            return opensense.error_result(
+                "Error: Failed to parse JSON and no partial objects found\n")
+    except httpx.TimeoutException:
+        print("API request timed out")
+        return opensense.error_result("Error: API request timed out\n")
+    except httpx.HTTPError as e:
+        print(f"API request failed: {e}")
+        return opensense.error_result(f"Error: API request failed - {e}\n")
+
+    sketch = sketches.TDigest()
+    result, stats = opensense.summarize(data, sketch)
+    updated_at = int(time.time())
+
+    try:
+        pipe = boxes.queue_index_update(get_redis_client().pipeline(), data)
+        await sketches.queue_store(pipe, sketch, updated_at).execute()
+    except redis.RedisError as e:
+        print(f"Redis error while updating box index and sketches: {e}")
+
+    try:
+        pipe = opensense.queue_snapshot_write(get_redis_client().pipeline(), result, updated_at)
+        await pipe.execute()
+    except redis.RedisError as e:
+        print(f"Redis error while caching data: {e}")
+        return result, stats, None
+
+    print("Data cached in Redis.")
+    return result, stats, (updated_at, CACHE_TTL)
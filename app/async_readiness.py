@@ -0,0 +1,37 @@
+'''Asyncio counterpart of the readiness module used by the ASGI app'''
+import json
+import httpx
+import redis
+from app import async_opensense
+from app.readiness import sensor_stats_status, combine_checks
+
+async def check_caching():
+    '''Check if caching content is older than 5 minutes'''
+    try:
+        ttl = await async_opensense.get_redis_client().ttl("temperature_data")
+
+        return ttl in (-2, -1)
+    except redis.RedisError as e:
+        print(f"Redis error while checking cache: {e}")
+        return True
+
+async def reachable_boxes():
+    '''Check if more than 50% of sensor boxes are reachable'''
+    try:
+        _, sensor_stats = await async_opensense.get_temperature()
+    except (json.JSONDecodeError, httpx.HTTPError, redis.RedisError) as e:
+        print(f"Error checking reachable boxes: {e}")
+        return 200
+
+    try:
+        return sensor_stats_status(sensor_stats)
+    except (ValueError, TypeError, KeyError) as e:
+        print(f"Data error checking reachable boxes: {e}")
+        return 400
+
+async def readiness_check():
+    '''Combined readiness check for the /readyz endpoint'''
+    boxes_status = await reachable_boxes()
+    cache_is_old = await check_caching()
+
+    return combine_checks(boxes_status, cache_is_old)
@@ -0,0 +1,23 @@
+'''Asyncio counterpart of the sketches module used by the ASGI app'''
+import asyncio
+import redis
+from app import async_opensense
+from app.sketches import (SKETCH_KEY, DEFAULT_WINDOW, DEFAULT_QUANTILES, UNAVAILABLE,
+                          parse_query, window_bounds, summary)
+
+async def quantiles(window=DEFAULT_WINDOW, values=DEFAULT_QUANTILES):
+    '''Temperature quantiles over a window as a (body, status code) pair'''
+    query, error = parse_query(window, values)
+    if error:
+        return error
+
+    seconds, parsed = query
+    try:
+        members = await async_opensense.get_redis_client().zrangebyscore(
+            SKETCH_KEY, *window_bounds(seconds))
+    except redis.RedisError as e:
+        print(f"Redis error while reading sketches: {e}")
+        return UNAVAILABLE
+
+    # Merging a week of sketches takes long enough to stall every other request
+    return await asyncio.to_thread(summary, members, window, parsed), 200
@@ -0,0 +1,80 @@
+'''Asyncio counterpart of the updates module used by the ASGI app'''
+import json
+import asyncio
+import redis
+from app.config import create_async_redis_client
+from app.updates import CHANNEL, KEEPALIVE, RECONNECT_DELAY, format_event
+
+class AsyncSubscriber:
+    '''Relay snapshots from a single Redis subscription to one queue per client'''
+
+    def __init__(self):
+        self._queues = set()
+        self._task = None
+
+    def listen(self):
+        '''Register a client and return the queue its snapshots arrive on'''
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+        # Clients only care about the latest snapshot, so queues stay tiny
+        queue = asyncio.Queue(maxsize=1)
+        self._queues.add(queue)
+        return queue
+
+    def remove(self, queue):
+        '''Unregister a disconnected client'''
+        self._queues.discard(queue)
+
+    def deliver(self, message):
+        '''Hand a published message to every client, replacing undelivered ones'''
+        snapshot = json.loads(message)
+        for queue in self._queues:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(snapshot)
+
+    async def _run(self):
+        '''Listen on the updates channel, reconnecting after Redis errors'''
+        while True:
+            client = create_async_redis_client()
+            try:
+                async with client.pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.subscribe(CHANNEL)
+                    while True:
+                        message = await pubsub.get_message(
+                            ignore_subscribe_messages=True,
+                            timeout=KEEPALIVE
+                        )
+                        if message:
+                            self.deliver(message["data"])
+            except redis.RedisError as e:
+                print(f"Redis error on {CHANNEL} subscription: {e}")
+                await asyncio.sleep(RECONNECT_DELAY)
+            finally:
+                await client.aclose()
+
+SUBSCRIBER = AsyncSubscriber()
+
+async def stream_events(initial=None):
+    '''Yield the initial snapshot, then every new one, with keepalive comments between'''
+    queue = SUBSCRIBER.listen()
+    last_id = None
+
+    try:
+        if initial is not None:
+            last_id = initial["updated_at"]
+            yield format_event(initial)
+
+        while True:
+            try:
+                snapshot = await asyncio.wait_for(queue.get(), KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+
+            if snapshot["updated_at"] != last_id:
+                last_id = snapshot["updated_at"]
+                yield format_event(snapshot)
+    finally:
+        SUBSCRIBER.remove(queue)
@@ -0,0 +1,97 @@
+'''Per-box last-seen index kept in a Redis sorted set'''
+import os
+import time
+from datetime import datetime, timezone
+import redis
+from app.config import shared_redis_client
+from app import readings
+
+BOX_INDEX_KEY = "box_last_seen"
+# Boxes not seen for this long are dropped from the index
+BOX_INDEX_RETENTION = int(os.environ.get('BOX_INDEX_RETENTION', 7 * 24 * 3600))
+BOX_STALE_MINUTES = int(os.environ.get('BOX_STALE_MINUTES', 60))
+
+UNAVAILABLE = ({"error": "Box index unavailable"}, 503)
+
+def last_seen(data):
+    '''Map each box id of a ReadingStore or list of boxes to its latest measurement time'''
+    return readings.as_store(data).box_last_seen()
+
+def queue_index_update(pipe, data, now=None):
+    '''Queue the index update for a refresh on a (sync or async) Redis pipeline'''
+    now = time.time() if now is None else now
+    seen = last_seen(data)
+    if seen:
+        # Only ever move a box forward in time
+        pipe.zadd(BOX_INDEX_KEY, seen, gt=True)
+    pipe.zremrangebyscore(BOX_INDEX_KEY, '-inf', now - BOX_INDEX_RETENTION)
+    return pipe
+
+def queue_health_queries(pipe, stale_minutes, now=None):
+    '''Queue the counts needed by health_summary on a Redis pipeline'''
+    now = time.time() if now is None else now
+    pipe.zcard(BOX_INDEX_KEY)
+    pipe.zcount(BOX_INDEX_KEY, f"({now - stale_minutes * 60}", '+inf')
+    return pipe
+
+def health_summary(results, stale_minutes):
+    '''Build the /boxes/health body from the queued query results'''
+    total, fresh = results
+    return {
+        "boxes": total,
+        "reachable": fresh,
+        "stale": total - fresh,
+        "reachable_percentage": round(fresh / total * 100, 2) if total else 100.0,
+        "stale_minutes": stale_minutes
+    }
+
+def box_status(box_id, score, stale_minutes, now=None):
+    '''Build the /boxes/<box_id> response from the box score'''
+    if score is None:
+        return {"error": f"Box {box_id} not in index"}, 404
+
+    now = time.time() if now is None else now
+    return {
+        "box_id": box_id,
+        "last_seen": datetime.fromtimestamp(score, timezone.utc).isoformat(),
+        "stale": score <= now - stale_minutes * 60
+    }, 200
+
+def update_index(data):
+    '''Record the latest measurement time of every box in a refresh'''
+    redis_client = shared_redis_client()
+    if redis_client is None:
+        return
+
+    try:
+        queue_index_update(redis_client.pipeline(), data).execute()
+    except redis.RedisError as e:
+        print(f"Redis error while updating box index: {e}")
+
+def health(stale_minutes=BOX_STALE_MINUTES):
+    '''Reachability of the indexed boxes as a (body, status code) pair'''
+    redis_client = shared_redis_client()
+    if redis_client is None:
+        return UNAVAILABLE
+
+    try:
+        results = queue_health_queries(redis_client.pipeline(), stale_minutes).execute()
+    except redis.RedisError as e:
+        print(f"Redis error while reading box index: {e}")
+        return UNAVAILABLE
+
+    return health_summary(results, stale_minutes), 200
+
+def status(box_id, stale_minutes=BOX_STALE_MINUTES):
+    '''Last-seen status of one box as a (body, status code) pair'''
+    redis_client = shared_redis_client()
+    if redis_client is None:
+        return UNAVAILABLE
+
+    try:
+        score = redis_client.zscore(BOX_INDEX_KEY, box_id)
+    except redis.RedisError as e:
+        print(f"Redis error while reading box index: {e}")
+        return UNAVAILABLE
+
+    return box_status(box_id, score, stale_minutes)
@@ -1,12 +1,23 @@
 '''Shared configuration module'''
 import os
+import threading
 import redis
+import redis.asyncio
 
 # Redis configuration
 REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
 REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
 REDIS_DB = int(os.environ.get('REDIS_DB', 0))
 CACHE_TTL = int(os.environ.get('CACHE_TTL', 300))
+# Threads per Gunicorn worker, shared with gunicorn_conf.py to size per-process limits
+WORKER_THREADS = int(os.environ.get('GUNICORN_THREADS', 8))
+# How long the last result stays available for shed requests
+STALE_TTL = int(os.environ.get('STALE_TTL', 86400))
+
+# Read once at import, the file only changes with a new image
+VERSION_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'version.txt')
+with open(VERSION_FILE, 'r', encoding="utf-8") as version_file:
+    APP_VERSION = version_file.read()
 
 def create_redis_client():
     '''Create and return Redis client with error handling'''
@@ -25,3 +36,34 @@ def create_redis_client():
     except (redis.ConnectionError, redis.TimeoutError) as e:
         print(f"Could not connect to Redis: {e}")
         return None, False
+
+# Client shared by the modules without one of their own, created on first use
+_shared_redis = {"client": None, "connected": False}
+_shared_redis_lock = threading.Lock()
+
+def shared_redis_client():
+    '''The Redis client shared by this process, or None if Redis was unreachable'''
+    with _shared_redis_lock:
+        if not _shared_redis["connected"]:
+            _shared_redis["client"], _ = create_redis_client()
+            _shared_redis["connected"] = True
+        return _shared_redis["client"]
+
+def reset_shared_redis_client():
+    '''Close the shared client so the next use reconnects, e.g. in a freshly forked worker'''
+    with _shared_redis_lock:
+        client, _shared_redis["client"] = _shared_redis["client"], None
+        _shared_redis["connected"] = False
+    if client is not None:
+        client.close()
+
+def create_async_redis_client():
+    '''Create an asyncio Redis client; connection errors surface on first use'''
+    return redis.asyncio.StrictRedis(
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        db=REDIS_DB,
+        decode_responses=True,
+        socket_connect_timeout=240,
+        socket_timeout=240
+    )
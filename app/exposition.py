@@ -0,0 +1,13 @@
+'''Prometheus exposition of this process, or of every Gunicorn worker in multiprocess mode'''
+import os
+from prometheus_client import CollectorRegistry, generate_latest, multiprocess
+
+def latest():
+    '''Render the metrics, merged across worker processes sharing PROMETHEUS_MULTIPROC_DIR'''
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if not path:
+        return generate_latest()
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=path)
+    return generate_latest(registry)
@@ -0,0 +1,88 @@
+'''Gunicorn configuration for the production serving mode'''
+# pylint: disable=invalid-name,unused-argument
+import os
+import signal
+import tempfile
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_class = 'gthread'
+
+# Import the app once in the master so workers share its memory pages
+preload_app = True
+
+# Upstream fetches can take minutes (see opensense.get_temperature timeouts),
+# so workers get that long before being killed and to drain on shutdown.
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 300))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 300))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+accesslog = '-'
+errorlog = '-'
+
+# Each worker counts its own metrics, so they write them to files here and /metrics
+# merges the files of every worker (prometheus_client multiprocess mode). The master
+# sets the variable before preloading the app, which already creates its files.
+prometheus_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR',
+                                os.path.join(tempfile.gettempdir(), 'hivebox-prometheus'))
+raw_env = [f"PROMETHEUS_MULTIPROC_DIR={prometheus_dir}"]
+os.makedirs(prometheus_dir, exist_ok=True)
+
+def on_starting(server):
+    '''Drop the metric files of a previous run, e.g. left on a reused emptyDir'''
+    for name in os.listdir(prometheus_dir):
+        os.remove(os.path.join(prometheus_dir, name))
+
+def post_fork(server, worker):
+    '''Recreate connection-holding clients so no socket is shared with the master'''
+    # Imported here so the config file can be loaded without the app on sys.path
+    # pylint: disable=import-outside-toplevel
+    from app import opensense, readiness, config, archiver
+
+    opensense.reset_redis_client()
+    readiness.reset_redis_client()
+    config.reset_shared_redis_client()
+    server.log.info("Worker %s initialized its clients", worker.pid)
+
+    # Threads do not survive the fork, so every worker starts its own archiver
+    # and competes for the lease
+    archiver.start()
+
+def post_worker_init(worker):
+    '''End open event streams as soon as a graceful shutdown starts'''
+    from app import updates  # pylint: disable=import-outside-toplevel
+
+    # Streams never finish on their own, so without this every SIGTERM would
+    # wait for the full graceful_timeout
+    handle_exit = worker.handle_exit
+
+    def close_streams_and_exit(sig, frame):
+        updates.SUBSCRIBER.close()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, close_streams_and_exit)
+
+def worker_int(worker):
+    '''Log workers interrupted before their in-flight requests finished'''
+    from app import updates  # pylint: disable=import-outside-toplevel
+
+    updates.SUBSCRIBER.close()
+    worker.log.warning("Worker %s interrupted, in-flight requests dropped", worker.pid)
+
+def child_exit(server, worker):
+    '''Stop reporting the live gauges of a worker that exited'''
+    from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+
+    multiprocess.mark_process_dead(worker.pid, prometheus_dir)
+
+def worker_exit(server, worker):
+    '''Close Redis connections when a worker exits after draining'''
+    # pylint: disable=import-outside-toplevel
+    from app import opensense, readiness, config, archiver
+
+    archiver.stop()
+    for client in (opensense.redis_client, readiness.redis_client):
+        if client is not None:
+            client.close()
+    config.reset_shared_redis_client()
@@ -0,0 +1,35 @@
+'''Helpers for HTTP conditional caching of the temperature snapshot'''
+from werkzeug.http import http_date, parse_date, parse_etags, quote_etag, unquote_etag
+
+# Sent with the last known result when a request is shed
+STALE_HEADERS = {"Cache-Control": "no-cache", "Warning": '110 - "Response is Stale"'}
+
+def snapshot_headers(snapshot):
+    '''Caching headers for a (updated_at, ttl) snapshot, or None when nothing is cached'''
+    if snapshot is None:
+        return {"Cache-Control": "no-cache"}
+
+    updated_at, ttl = snapshot
+
+    # Weak, as the body also names the pod that served it
+    return {
+        "ETag": quote_etag(str(updated_at), weak=True),
+        "Last-Modified": http_date(updated_at),
+        "Cache-Control": f"public, max-age={ttl}"
+    }
+
+def not_modified(request_headers, headers):
+    '''Check if the client copy matching the request validators is still current'''
+    if "ETag" not in headers:
+        return False
+
+    if_none_match = request_headers.get("If-None-Match")
+    if if_none_match:
+        etag, _ = unquote_etag(headers["ETag"])
+        return parse_etags(if_none_match).contains_weak(etag)
+
+    if_modified_since = parse_date(request_headers.get("If-Modified-Since"))
+    if if_modified_since:
+        return parse_date(headers["Last-Modified"]) <= if_modified_since
+
+    return False
@@ -1,13 +1,22 @@
 '''Module containing the main function of the app.'''
-import os
 import socket
-from flask import Flask, Response
-from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from flask import Flask, Response, request
+from prometheus_client import CONTENT_TYPE_LATEST
 from app import opensense
 from app import storage
 from app import readiness
+from app import http_cache
+from app import updates
+from app import boxes
+from app import sketches
+from app import profiling
+from app import admission
+from app import archiver
+from app import exposition
+from app.config import APP_VERSION
 
 app = Flask(__name__)
+profiling.init_app(app)
 
 HOSTNAME = socket.gethostname()
 IPADDR = socket.gethostbyname(HOSTNAME)
@@ -15,41 +24,87 @@ IPADDR = socket.gethostbyname(HOSTNAME)
 @app.route('/version')
 def print_version():
     '''Function printing the current version of the app.'''
-    version_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'version.txt')
+    return f"Current app version: {APP_VERSION}\n"
 
-    with open(version_file, 'r', encoding="utf-8") as f:
-        version = f.read()
-
-    return f"Current app version: {version}\n"
+def stale_temperature():
+    '''Last known temperature, answered to requests shed by admission control.'''
+    result = opensense.stale_result()
+    if result is None:
+        return None
+    return result + f"From: {IPADDR}\n", http_cache.STALE_HEADERS
 
 @app.route('/temperature')
+@admission.on_shed(fallback=stale_temperature)
 def get_temperature():
     '''Function to get the current temperature.'''
-    result, _ = opensense.get_temperature()
-    return result + f"From: {IPADDR}\n"
+    result, _, snapshot = opensense.get_snapshot()
+    headers = http_cache.snapshot_headers(snapshot)
+
+    if http_cache.not_modified(request.headers, headers):
+        return "", 304, headers
+
+    return result + f"From: {IPADDR}\n", headers
+
+@app.route('/temperature/stream')
+def temperature_stream():
+    '''Server-Sent Events stream pushing every new temperature snapshot.'''
+    # The slot is held until the response is closed, not just until the view returns
+    if not updates.acquire_stream():
+        admission.SHED_REQUESTS.labels('stream', 'stream_limit').inc()
+        return admission.shed_response()
+
+    try:
+        initial = updates.initial_event(*opensense.get_snapshot())
+    except admission.Shed:
+        # The stream still gets the snapshot of the refresh under way
+        initial = None
+    except Exception:
+        updates.release_stream()
+        raise
+
+    response = Response(updates.stream_events(initial),
+                        mimetype="text/event-stream",
+                        headers=updates.STREAM_HEADERS)
+    response.call_on_close(updates.release_stream)
+    return response
+
+@app.route('/temperature/quantiles')
+def temperature_quantiles():
+    '''Temperature quantiles over a time window, merged from the per-refresh sketches.'''
+    return sketches.quantiles(request.args.get('window', sketches.DEFAULT_WINDOW),
+                              request.args.get('q', sketches.DEFAULT_QUANTILES))
+
+@app.route('/boxes/health')
+def boxes_health():
+    '''Reachability of sensor boxes from the last-seen index, without upstream calls.'''
+    stale_minutes = request.args.get('stale_minutes', boxes.BOX_STALE_MINUTES, type=int)
+    return boxes.health(stale_minutes)
+
+@app.route('/boxes/<box_id>')
+def box_status(box_id):
+    '''Last-seen status of a single sensor box.'''
+    stale_minutes = request.args.get('stale_minutes', boxes.BOX_STALE_MINUTES, type=int)
+    return boxes.status(box_id, stale_minutes)
 
 @app.route('/metrics')
 def metrics():
     '''Function to return Prometheus metrics.'''
-    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+    return Response(exposition.latest(), mimetype=CONTENT_TYPE_LATEST)
 
 @app.route('/store')
+@admission.limit('store')
 def store():
     '''Function to store results in MinIO.'''
     return storage.store_temperature_data()
 
 @app.route('/readyz')
+@admission.limit('readyz', fallback=lambda: readiness.readyz_response(readiness.last_status()))
 def readyz():
     '''Readiness probe endpoint'''
     status_code = readiness.readiness_check()
 
-    if status_code == 200:
-        return {"status": "ready"}, 200
-
-    return {
-        "status": "not ready", 
-        "error": "More than 50% of sensors unreachable and cache expired"
-    }, 503
+    return readiness.readyz_response(status_code)
 
 if __name__ == "__main__":
+    archiver.start()
     app.run()
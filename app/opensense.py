@@ -1,16 +1,32 @@
 '''Module to get entries from OpenSenseMap API and get the average temperature'''
 # pylint: disable=too-many-locals,too-many-branches,too-many-statements
 from datetime import datetime, timezone, timedelta
+import os
 import json
+import time
 import requests
 import redis
-from app.config import create_redis_client, CACHE_TTL
+from app.config import create_redis_client, CACHE_TTL, STALE_TTL
+from app import updates
+from app import boxes
+from app import sketches
+from app import readings
+from app import profiling
+from app import admission
 
 # Use shared Redis client
 redis_client, REDIS_AVAILABLE = create_redis_client()
 
 _sensor_stats = {"total_sensors": 0, "null_count": 0}
 
+# Concurrent cache misses of this process wait for one upstream refresh
+REFRESH = admission.SingleFlight()
+
+def reset_redis_client():
+    '''Recreate the module Redis client, e.g. in a freshly forked worker'''
+    global redis_client, REDIS_AVAILABLE  # pylint: disable=global-statement
+    redis_client, REDIS_AVAILABLE = create_redis_client()
+
 def classify_temperature(average):
     '''Classify temperature based on ranges using dictionary approach'''
     # Define temperature ranges and their classifications
@@ -27,146 +43,257 @@ def classify_temperature(average):
 
     return "Unknown"  # Default case
 
-def _parse_partial_json_array(text: str):
-    """Parse as many full objects as possible from a (possibly truncated) JSON array."""
+def _load_json_array(text: str, add):
+    """Pass each full object of a (possibly truncated) JSON array to add, one at a time.
+
+    Returns True if the array was complete.
+    """
     decoder = json.JSONDecoder()
-    items = []
     i = text.find('[')
     if i == -1:
-        return items
+        return False
     i += 1  # past '['
     n = len(text)
     while i < n:
         while i < n and text[i].isspace():
             i += 1
-        if i >= n or text[i] == ']':
+        if i >= n:
             break
+        if text[i] == ']':
+            return True
         try:
             obj, end = decoder.raw_decode(text, i)
         except json.JSONDecodeError:
             # truncated object at the end; stop with what we have
             break
-        items.append(obj)
+        add(obj)
         i = end
         while i < n and text[i].isspace():
             i += 1
         if i < n and text[i] == ',':
             i += 1
-    return items
+    return False
 
-def get_temperature():
-    '''Function to get the average temperature from OpenSenseMap API.'''
-    if REDIS_AVAILABLE:
-        try:
-            cached_data = redis_client.get("temperature_data")
-            if cached_data:
-                print("Using cached data from Redis.")
-                cached_result = cached_data
-                default_stats = {"total_sensors": 0, "null_count": 0}
-                return cached_result, default_stats
-        except redis.RedisError as e:
-            print(f"Redis error: {e}. Proceeding without cache.")
+OPENSENSE_URL = "https://api.opensensemap.org/boxes"
 
-    print("Fetching new data from OpenSenseMap API...")
+# Streaming configuration
+MAX_MB = float(os.environ.get('OPENSENSE_MAX_MB', 0.5))
+MAX_BYTES = int(MAX_MB * 1024 * 1024)
+CHUNK_SIZE = 64 * 1024  # 64 KB
+
+def queue_snapshot_read(pipe):
+    '''Queue the reads of the cached body, its timestamp and its TTL on a pipeline'''
+    pipe.get("temperature_data")
+    pipe.get("temperature_updated")
+    pipe.ttl("temperature_data")
+    return pipe
 
+def parse_snapshot(cached, updated_at, ttl):
+    '''Combine the queued reads into (body, (updated_at, ttl)); the info is None
+    when there is no complete snapshot.'''
+    if cached is None or updated_at is None or ttl < 0:
+        return cached, None
+    return cached, (int(updated_at), ttl)
+
+def cache_hit(values):
+    '''(result, stats, snapshot info) from the replies of queue_snapshot_read, or None'''
+    cached_data, info = parse_snapshot(*values)
+    if not cached_data:
+        return None
+    print("Using cached data from Redis.")
+    return cached_data, {"total_sensors": 0, "null_count": 0}, info
+
+def error_result(message):
+    '''(result, stats, snapshot info) of a refresh that failed, nothing gets cached'''
+    return message, {"total_sensors": 0, "null_count": 0}, None
+
+def queue_snapshot_write(pipe, result, updated_at):
+    '''Queue the keys of a new snapshot and its announcement on a MULTI pipeline'''
+    pipe.setex("temperature_data", CACHE_TTL, result)
+    pipe.setex("temperature_updated", CACHE_TTL, updated_at)
+    pipe.setex("temperature_data_stale", STALE_TTL, result)
+    pipe.publish(updates.CHANNEL, updates.snapshot_message(result, updated_at))
+    return pipe
+
+def stale_result():
+    '''Return the last computed result even if its cache entry expired, or None.'''
+    if not REDIS_AVAILABLE:
+        return None
+
+    try:
+        return redis_client.get("temperature_data_stale")
+    except redis.RedisError as e:
+        print(f"Redis error while reading stale data: {e}")
+        return None
+
+def request_params():
+    '''Query parameters for boxes measured within the last hour.'''
     # Ensuring that data is not older than 1 hour.
     time_iso = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat().replace("+00:00", "Z")
 
-    params = {
+    return {
         "date": time_iso,
         "format": "json"
     }
 
-    # Streaming configuration
-    max_mb = 0.5
-    max_bytes = int(max_mb * 1024 * 1024)
+def parse_body(chunks, encoding, truncated):
+    '''Decode the downloaded chunks into a ReadingStore, or None if nothing parses.
+
+    Boxes are decoded one at a time and reduced to the store right away, so the
+    nested box dicts never all exist at once.
+    '''
+    body = b"".join(chunks)
+    chunks.clear()
+    text = body.decode(encoding or "utf-8", errors="replace")
+    del body
+
+    store = readings.ReadingStore()
+    if not text.lstrip().startswith('['):
+        # Not a list of boxes, e.g. an error object
+        try:
+            json.loads(text)
+            return store
+        except json.JSONDecodeError:
+            return None
+
+    if _load_json_array(text, store.add_box):
+        return store
+
+    if not truncated:
+        print("Warning: Unexpected JSON parse error. Keeping the boxes parsed so far.")
+    return store if len(store) else None
+
+def summarize(data, sketch=None):
+    '''Compute the average temperature message and sensor stats for a ReadingStore
+    or a list of boxes.
+
+    Every valid reading is also added to sketch when one is given.
+    '''
+    store = readings.as_store(data)
+    _sensor_stats["total_sensors"] = len(store) - store.count(readings.NO_SENSORS)
+    # A box is unreachable if none of its temperature sensors has a reading,
+    # so null_count is in boxes like total_sensors
+    _sensor_stats["null_count"] = store.count(readings.UNREACHABLE)
+    temp_list = store.values
+
+    if sketch is not None:
+        for value in temp_list:
+            sketch.add(value)
+
+    average = sum(temp_list) / len(temp_list) if temp_list else 0.0
+
+    if not temp_list:
+        print("Warning: No valid temperature readings found")
+
+    # Use the dictionary-based classification
+    status = classify_temperature(average)
+    result = f'Average temperature: {average:.2f} °C ({status})\n'
+
+    return result, _sensor_stats
+
+def get_temperature():
+    '''Function to get the average temperature from OpenSenseMap API.'''
+    result, stats, _ = get_snapshot()
+    return result, stats
+
+def get_snapshot():
+    '''Return (result, stats, snapshot info) with the info describing that very result.
+
+    Body, timestamp and TTL are read in one transaction, so the ETag built from the
+    info always matches the body. Only cache misses go through admission control,
+    which raises admission.Shed when too many of them are already waiting.
+    '''
+    cached = read_snapshot()
+    if cached is not None:
+        return cached
+
+    with admission.admit('temperature'):
+        return REFRESH.run(refresh_snapshot)
+
+def read_snapshot():
+    '''Return the cached (result, stats, snapshot info), or None on a cache miss.'''
+    if not REDIS_AVAILABLE:
+        return None
+
+    try:
+        with profiling.stage("cache_read"):
+            values = queue_snapshot_read(redis_client.pipeline()).execute()
+    except redis.RedisError as e:
+        print(f"Redis error: {e}. Proceeding without cache.")
+        return None
+    return cache_hit(values)
+
+def refresh_snapshot():
+    '''Fetch, summarize and cache a new snapshot, as (result, stats, snapshot info).'''
+    # The refresh this one waited for may have just filled the cache
+    cached = read_snapshot()
+    if cached is not None:
+        return cached
+
+    print("Fetching new data from OpenSenseMap API...")
+
+    params = request_params()
 
     print('Getting data from OpenSenseMap API...')
 
     try:
         # Stream the response and count bytes
-        response = requests.get(
-            "https://api.opensensemap.org/boxes",
-            params=params,
-            stream=True,
-            timeout=(180, 60)
-        )
-        response.raise_for_status()
-
-        downloaded = 0
-        chunks = []
-        truncated = False
-
-        for chunk in response.iter_content(chunk_size=64 * 1024):  # 64 KB
-            if not chunk:
-                break
-            chunks.append(chunk)
-            downloaded += len(chunk)
-            if downloaded >= max_bytes:
-                print(f"Reached {max_mb} MB limit ({downloaded:,} bytes), stopping download")
-                truncated = True
-                response.close()
-                break
+        with profiling.stage("network"):
+            response = requests.get(
+                OPENSENSE_URL,
+                params=params,
+                stream=True,
+                timeout=(180, 60)
+            )
+            response.raise_for_status()
+
+            downloaded = 0
+            chunks = []
+            truncated = False
+
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                downloaded += len(chunk)
+                if downloaded >= MAX_BYTES:
+                    print(f"Reached {MAX_MB} MB limit ({downloaded:,} bytes), stopping download")
+                    truncated = True
+                    response.close()
+                    break
 
         print(f'Bytes downloaded: {downloaded:,}')
         print('Data retrieved successfully!' + (" (partial)" if truncated else ""))
 
         # Build body and parse JSON
-        body = b"".join(chunks)
-        text = body.decode(response.encoding or "utf-8", errors="replace")
-
-        try:
-            data = json.loads(text)
-        except json.JSONDecodeError:
-            if not truncated:
-                print("Warning: Unexpected JSON parse error. Trying partial parse.")
-            data = _parse_partial_json_array(text)
-            if not data:
-                return "Error: Failed to parse JSON and no partial objects found\n", {
-                    "total_sensors": 0,
-                    "null_count": 0
-                    }
+        with profiling.stage("parse"):
+            data = parse_body(chunks, response.encoding, truncated)
+        if data is None:
+            return error_result("Error: Failed to parse JSON and no partial objects found\n")
 
     except requests.Timeout:
         print("API request timed out")
-        return "Error: API request timed out\n", {"total_sensors": 0, "null_count": 0}
+        return error_result("Error: API request timed out\n")
     except requests.RequestException as e:
         print(f"API request failed: {e}")
-        return f"Error: API request failed - {e}\n", {"total_sensors": 0, "null_count": 0}
-
-    # Process the data (keeping the existing logic)
-    _sensor_stats["total_sensors"] = sum(1 for d in data if isinstance(d, dict) and "sensors" in d)
-    res = [d.get('sensors') for d in data if isinstance(d, dict) and 'sensors' in d]
-
-    temp_list = []
-    _sensor_stats["null_count"] = 0
-
-    for sensor_list in res:
-        for measure in sensor_list:
-            if measure.get('unit') == "°C" and 'lastMeasurement' in measure:
-                last = measure['lastMeasurement']
-                if last is not None and isinstance(last, dict) and 'value' in last:
-                    try:
-                        temp_list.append(float(last['value']))
-                    except (TypeError, ValueError):
-                        _sensor_stats["null_count"] += 1
-                else:
-                    _sensor_stats["null_count"] += 1
+        return error_result(f"Error: API request failed - {e}\n")
 
-    average = sum(temp_list) / len(temp_list) if temp_list else 0.0
+    with profiling.stage("aggregate"):
+        sketch = sketches.TDigest()
+        result, stats = summarize(data, sketch)
 
-    if not temp_list:
-        print("Warning: No valid temperature readings found")
+    with profiling.stage("cache_write"):
+        updated_at = int(time.time())
+        boxes.update_index(data)
+        sketches.store(sketch, updated_at)
 
-    # Use the dictionary-based classification
-    status = classify_temperature(average)
-    result = f'Average temperature: {average:.2f} °C ({status})\n'
+        info = None
+        if REDIS_AVAILABLE:
+            try:
+                queue_snapshot_write(redis_client.pipeline(), result, updated_at).execute()
+                print("Data cached in Redis.")
+                info = (updated_at, CACHE_TTL)
+            except redis.RedisError as e:
+                print(f"Redis error while caching data: {e}")
 
-    if REDIS_AVAILABLE:
-        try:
-            redis_client.setex("temperature_data", CACHE_TTL, result)
-            print("Data cached in Redis.")
-        except redis.RedisError as e:
-            print(f"Redis error while caching data: {e}")
-
-    return result, _sensor_stats
+    return result, stats, info
@@ -0,0 +1,149 @@
+'''Opt-in sampling profiler for Flask requests writing collapsed-stack profiles'''
+import os
+import re
+import hmac
+import sys
+import time
+import random
+import itertools
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from flask import request, jsonify, send_from_directory, abort
+
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN', '')
+PROFILE_HEADER = 'X-Profile'
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/profiles')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL_MS', 5)) / 1000
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 50))
+
+_local = threading.local()
+# Keeps profiles of the same route taken in the same second apart
+_sequence = itertools.count()
+
+class Profile:
+    '''Sample the stack of one thread into collapsed-stack counts'''
+
+    def __init__(self, label, thread_id=None):
+        self.label = label
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.stages = []
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        '''Start sampling'''
+        self._sampler.start()
+        return self
+
+    def stop(self):
+        '''Stop sampling and wait for the sampler thread'''
+        self._stop.set()
+        self._sampler.join()
+        return self
+
+    def sample(self):
+        '''Record the current stack of the profiled thread once'''
+        frame = sys._current_frames().get(self.thread_id)  # pylint: disable=protected-access
+        if frame is None:
+            return
+
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+
+        stack = [self.label] + [f"stage:{name}" for name in tuple(self.stages)]
+        self.stacks[";".join(stack + frames[::-1])] += 1
+
+    def _run(self):
+        while not self._stop.wait(PROFILE_INTERVAL):
+            self.sample()
+
+    def collapsed(self):
+        '''Profile in the collapsed-stack format read by flamegraph.pl and speedscope'''
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+@contextmanager
+def stage(name):
+    '''Label the samples taken inside the block when the current request is profiled'''
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        yield
+        return
+
+    profile.stages.append(name)
+    try:
+        yield
+    finally:
+        profile.stages.pop()
+
+def _should_profile():
+    '''Profile requests carrying the profile header and the token, plus a random sample'''
+    if request.headers.get(PROFILE_HEADER) and _authorized():
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def _authorized():
+    '''Check the bearer token guarding the profile endpoints'''
+    expected = f"Bearer {PROFILING_TOKEN}".encode()
+    given = request.headers.get('Authorization', '').encode()
+    return bool(PROFILING_TOKEN) and hmac.compare_digest(given, expected)
+
+def write_profile(profile):
+    '''Write a finished profile to PROFILE_DIR and drop the oldest beyond PROFILE_MAX_FILES'''
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    label = re.sub(r'[^A-Za-z0-9]+', '_', profile.label).strip('_')
+    name = f"{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{next(_sequence)}_{label}.collapsed"
+
+    with open(os.path.join(PROFILE_DIR, name), 'w', encoding="utf-8") as f:
+        f.write(profile.collapsed())
+
+    for old in list_profiles()[PROFILE_MAX_FILES:]:
+        os.remove(os.path.join(PROFILE_DIR, old))
+    return name
+
+def list_profiles():
+    '''Profile file names, newest first'''
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    names = [n for n in os.listdir(PROFILE_DIR) if n.endswith('.collapsed')]
+    return sorted(names, key=lambda n: os.path.getmtime(os.path.join(PROFILE_DIR, n)),
+                  reverse=True)
+
+def _start_profile():
+    if _should_profile():
+        _local.profile = Profile(f"{request.method} {request.path}").start()
+
+def _finish_profile(_exc):
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        return
+    _local.profile = None
+    print(f"Profile written: {write_profile(profile.stop())}")
+
+def profiles_index():
+    '''List the stored profiles'''
+    if not _authorized():
+        abort(401)
+    return jsonify(list_profiles())
+
+def profile_download(name):
+    '''Download one stored profile'''
+    if not _authorized():
+        abort(401)
+    return send_from_directory(PROFILE_DIR, name, mimetype="text/plain")
+
+def init_app(app):
+    '''Register the profiling hooks and endpoints; does nothing unless PROFILING_ENABLED'''
+    if not PROFILING_ENABLED:
+        return
+
+    app.before_request(_start_profile)
+    app.teardown_request(_finish_profile)
+    app.add_url_rule('/profiles', 'profiles_index', profiles_index)
+    app.add_url_rule('/profiles/<name>', 'profile_download', profile_download)
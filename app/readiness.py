@@ -7,6 +7,14 @@ from app.config import create_redis_client
 
 redis_client, REDIS_AVAILABLE = create_redis_client()
 
+# Last combined result, answered when a probe is shed
+_last_status = {"status_code": 200}
+
+def reset_redis_client():
+    '''Recreate the module Redis client, e.g. in a freshly forked worker'''
+    global redis_client, REDIS_AVAILABLE  # pylint: disable=global-statement
+    redis_client, REDIS_AVAILABLE = create_redis_client()
+
 def check_caching():
     '''Check if caching content is older than 5 minutes'''
     if not REDIS_AVAILABLE:
@@ -24,23 +32,48 @@ def check_caching():
         print(f"Redis error while checking cache: {e}")
         return True
 
+def sensor_stats_status(sensor_stats):
+    '''Return 400 if more than 50% of the sensors in the stats are unreachable'''
+    total_boxes = sensor_stats.get('total_sensors', 0)
+    unreachable = sensor_stats.get('null_count', 0)
+
+    # No sensors configured => treat as healthy
+    if total_boxes == 0:
+        return 200
+
+    percentage_unreachable = (unreachable / total_boxes) * 100
+
+    # Fail only if strictly more than 50% are unreachable
+    if percentage_unreachable > 50:
+        return 400
+    return 200
+
+def combine_checks(boxes_status, cache_is_old):
+    '''Readiness status code from the sensor and cache checks'''
+    # Only fail if BOTH conditions are bad
+    status_code = 503 if boxes_status == 400 and cache_is_old else 200
+    _last_status["status_code"] = status_code
+    return status_code
+
+def last_status():
+    '''Most recent readiness status code'''
+    return _last_status["status_code"]
+
+def readyz_response(status_code):
+    '''JSON body and status code returned by the /readyz endpoint'''
+    if status_code == 200:
+        return {"status": "ready"}, 200
+
+    return {
+        "status": "not ready",
+        "error": "More than 50% of sensors unreachable and cache expired"
+    }, 503
+
 def reachable_boxes():
     '''Check if more than 50% of sensor boxes are reachable'''
     try:
         _, sensor_stats = get_temperature()
-        total_boxes = sensor_stats.get('total_sensors', 0)
-        unreachable = sensor_stats.get('null_count', 0)
-
-        # No sensors configured => treat as healthy
-        if total_boxes == 0:
-            return 200
-
-        percentage_unreachable = (unreachable / total_boxes) * 100
-
-        # Fail only if strictly more than 50% are unreachable
-        if percentage_unreachable > 50:
-            return 400
-        return 200
+        return sensor_stats_status(sensor_stats)
 
     except (json.JSONDecodeError, requests.exceptions.RequestException, redis.RedisError) as e:
         print(f"Error checking reachable boxes: {e}")
@@ -55,11 +88,7 @@ def readiness_check():
         boxes_status = reachable_boxes()
         cache_is_old = check_caching()
 
-        # Only fail if BOTH conditions are bad
-        if boxes_status == 400 and cache_is_old:
-            return 503
-
-        return 200
+        return combine_checks(boxes_status, cache_is_old)
     except redis.RedisError as e:
         # If Redis is completely unavailable, still allow the service to be ready
         print(f"Redis error during readiness check: {e}")
@@ -0,0 +1,113 @@
+'''Compact columnar store of the boxes of one refresh, built while parsing'''
+import math
+from array import array
+from datetime import datetime
+
+TEMPERATURE_UNIT = "°C"
+
+# Per-box state, from the sensors of the box
+NO_SENSORS = -1     # no sensors list, not counted as a box with sensors
+NO_TEMPERATURE = 0  # no temperature sensor with a lastMeasurement entry
+UNREACHABLE = 1     # temperature sensors but no valid reading
+REPORTING = 2       # at least one valid temperature reading
+
+MISSING = math.nan
+
+def parse_timestamp(value):
+    '''Convert an OpenSenseMap ISO 8601 date to epoch seconds, or None'''
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+def _coordinates(box):
+    '''(longitude, latitude) of a box, NaN when unknown'''
+    location = box.get('currentLocation')
+    coordinates = location.get('coordinates') if isinstance(location, dict) else None
+    try:
+        return float(coordinates[0]), float(coordinates[1])
+    except (TypeError, ValueError, IndexError):
+        return MISSING, MISSING
+
+class ReadingStore:  # pylint: disable=too-many-instance-attributes
+    '''Only the fields the app needs, in typed arrays instead of nested dicts.
+
+    Boxes are rows of box_ids/longitude/latitude/last_seen/state, valid temperature
+    readings are rows of values/reading_box/reading_time, reading_box being the box row.
+    '''
+    __slots__ = ('box_ids', 'longitude', 'latitude', 'last_seen', 'state',
+                 'values', 'reading_box', 'reading_time')
+
+    def __init__(self):
+        self.box_ids = []
+        self.longitude = array('d')
+        self.latitude = array('d')
+        self.last_seen = array('d')
+        self.state = array('b')
+        self.values = array('d')
+        self.reading_box = array('L')
+        self.reading_time = array('d')
+
+    def __len__(self):
+        return len(self.box_ids)
+
+    @classmethod
+    def from_boxes(cls, data):
+        '''Build a store from already decoded boxes'''
+        store = cls()
+        for box in data:
+            store.add_box(box)
+        return store
+
+    def add_box(self, box):
+        '''Append the fields of one decoded box; anything but a dict is ignored'''
+        if not isinstance(box, dict):
+            return
+
+        row = len(self.box_ids)
+        times = [parse_timestamp(box.get('lastMeasurementAt'))]
+        state = NO_SENSORS if 'sensors' not in box else NO_TEMPERATURE
+
+        for measure in box.get('sensors') or []:
+            if not isinstance(measure, dict):
+                continue
+            last = measure.get('lastMeasurement')
+            if not isinstance(last, dict):
+                last = {}
+            created = parse_timestamp(last.get('createdAt'))
+            times.append(created)
+
+            if measure.get('unit') != TEMPERATURE_UNIT or 'lastMeasurement' not in measure:
+                continue
+            state = max(state, UNREACHABLE)
+            try:
+                value = float(last['value'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            state = REPORTING
+            self.values.append(value)
+            self.reading_box.append(row)
+            self.reading_time.append(MISSING if created is None else created)
+
+        times = [t for t in times if t is not None]
+        lon, lat = _coordinates(box)
+        self.box_ids.append(box.get('_id'))
+        self.longitude.append(lon)
+        self.latitude.append(lat)
+        self.last_seen.append(max(times) if times else MISSING)
+        self.state.append(state)
+
+    def count(self, *states):
+        '''Number of boxes in any of the given states'''
+        return sum(1 for state in self.state if state in states)
+
+    def box_last_seen(self):
+        '''Map each box id to the time of its latest measurement'''
+        return {box_id: seen for box_id, seen in zip(self.box_ids, self.last_seen)
+                if box_id is not None and not math.isnan(seen)}
+
+def as_store(data):
+    '''Accept either a ReadingStore or a list of decoded boxes'''
+    return data if isinstance(data, ReadingStore) else ReadingStore.from_boxes(data)
@@ -0,0 +1,236 @@
+'''Mergeable t-digest sketches of the temperature readings of every refresh'''
+import os
+import re
+import json
+import math
+import time
+import socket
+import redis
+from app.config import shared_redis_client
+
+SKETCH_KEY = "temperature_sketches"
+# Sketches older than this are dropped, it bounds the longest window
+SKETCH_RETENTION = int(os.environ.get('SKETCH_RETENTION', 7 * 24 * 3600))
+SKETCH_COMPRESSION = int(os.environ.get('SKETCH_COMPRESSION', 100))
+DEFAULT_WINDOW = "24h"
+DEFAULT_QUANTILES = "0.5,0.95,0.99"
+WINDOW_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+UNAVAILABLE = ({"error": "Sketch store unavailable"}, 503)
+
+class TDigest:
+    '''Merging t-digest: at most about compression / 2 weighted centroids approximating
+    the quantiles of any number of readings, most precise at the tails'''
+
+    def __init__(self, compression=SKETCH_COMPRESSION, centroids=(), bounds=None):
+        self.compression = compression
+        self.centroids = [tuple(c) for c in centroids]  # (mean, weight), sorted by mean
+        self.min, self.max = bounds if bounds else (float('inf'), float('-inf'))
+        self._buffer = []
+
+    @property
+    def count(self):
+        '''Number of readings summarized'''
+        return sum(w for _, w in self.centroids) + sum(w for _, w in self._buffer)
+
+    def add(self, value, weight=1):
+        '''Add one reading'''
+        value = float(value)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self._buffer.append((value, weight))
+        if len(self._buffer) >= 5 * self.compression:
+            self._compress()
+        return self
+
+    def merge(self, other):
+        '''Fold another sketch into this one'''
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._buffer.extend(other.centroids)
+        self._buffer.extend(other._buffer)  # pylint: disable=protected-access
+        if len(self._buffer) >= 5 * self.compression:
+            self._compress()
+        return self
+
+    def _compress(self):
+        '''Merge neighbouring centroids while they stay under the t-digest size bound'''
+        if not self._buffer:
+            return
+        points = sorted(self.centroids + self._buffer)
+        self._buffer = []
+        total = sum(w for _, w in points)
+
+        merged = [points[0]]
+        before = 0  # weight of the centroids left of the last merged one
+        k_left = self._scale(0)
+        for mean, weight in points[1:]:
+            last_mean, last_weight = merged[-1]
+            size = last_weight + weight
+            if self._scale((before + size) / total) - k_left <= 1:
+                merged[-1] = (last_mean + (mean - last_mean) * weight / size, size)
+            else:
+                before += last_weight
+                k_left = self._scale(before / total)
+                merged.append((mean, weight))
+        self.centroids = merged
+
+    def _scale(self, q):
+        '''k1 scale function: a centroid may span one unit, so centroids shrink at the tails'''
+        return self.compression / (2 * math.pi) * math.asin(2 * min(q, 1) - 1)
+
+    def quantile(self, q):
+        '''Estimate the q quantile (0 <= q <= 1), or None for an empty sketch'''
+        self._compress()
+        if not self.centroids:
+            return None
+
+        # Interpolate between centroid centres, anchored at the exact min and max
+        target = q * self.count
+        prev_mean, prev_position = self.min, 0
+        position = 0
+        for mean, weight in self.centroids:
+            centre = position + weight / 2
+            if target < centre:
+                break
+            prev_mean, prev_position = mean, centre
+            position += weight
+        else:
+            mean, centre = self.max, position
+
+        if centre == prev_position:
+            return prev_mean
+        return prev_mean + (mean - prev_mean) * (target - prev_position) / (centre - prev_position)
+
+    def to_dict(self):
+        '''JSON-serializable form of the sketch'''
+        self._compress()
+        return {
+            "compression": self.compression,
+            "min": self.min,
+            "max": self.max,
+            "centroids": [[round(mean, 4), weight] for mean, weight in self.centroids]
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        '''Rebuild a sketch from to_dict output'''
+        return cls(data["compression"], data["centroids"], (data["min"], data["max"]))
+
+def sketch_member(sketch, updated_at):
+    '''Serialize the sketch of a refresh, unique per refresh and producer'''
+    return json.dumps({
+        "updated_at": updated_at,
+        "source": f"{socket.gethostname()}:{os.getpid()}",
+        **sketch.to_dict()
+    })
+
+def queue_store(pipe, sketch, updated_at, now=None):
+    '''Queue the sketch of a refresh on a (sync or async) Redis pipeline'''
+    now = time.time() if now is None else now
+    if sketch.count:
+        pipe.zadd(SKETCH_KEY, {sketch_member(sketch, updated_at): updated_at})
+    pipe.zremrangebyscore(SKETCH_KEY, '-inf', now - SKETCH_RETENTION)
+    return pipe
+
+def parse_window(window):
+    '''Convert a window such as "90m", "24h" or "7d" to seconds, or None if invalid'''
+    unit = WINDOW_UNITS.get(window[-1:], None)
+    amount = window[:-1] if unit else window
+    if not amount.isdigit() or int(amount) == 0:
+        return None
+    return int(amount) * (unit or 1)
+
+def parse_quantiles(text):
+    '''Parse a comma-separated list of quantiles between 0 and 1, or None if invalid'''
+    try:
+        values = [float(q) for q in text.split(",")]
+    except ValueError:
+        return None
+    if not all(0 <= q <= 1 for q in values):
+        return None
+    return values
+
+def parse_query(window, text):
+    '''Validate the query parameters into (seconds, quantiles), or an error response'''
+    seconds = parse_window(window)
+    if seconds is None or seconds > SKETCH_RETENTION:
+        return None, ({"error": f"Invalid window {window}, "
+                                f"use e.g. 24h or 7d up to {SKETCH_RETENTION}s"}, 400)
+    values = parse_quantiles(text)
+    if values is None:
+        return None, ({"error": f"Invalid quantiles {text}, use e.g. 0.5,0.95"}, 400)
+    return (seconds, values), None
+
+def window_bounds(seconds, now=None):
+    '''Score range of the sketches inside a window ending now'''
+    now = time.time() if now is None else now
+    return now - seconds, '+inf'
+
+def merge_members(members):
+    '''Merge serialized sketches, e.g. from Redis or the MinIO archive, into one'''
+    merged = TDigest()
+    for member in members:
+        merged.merge(TDigest.from_dict(json.loads(member)))
+    return merged
+
+def _rounded(value):
+    return None if value is None else round(value, 2)
+
+def summary(members, window, values):
+    '''Build the /temperature/quantiles body from the sketches of a window'''
+    merged = merge_members(members)
+    return {
+        "window": window,
+        "sketches": len(members),
+        "readings": merged.count,
+        "quantiles": {f"p{q * 100:g}": _rounded(merged.quantile(q)) for q in values}
+    }
+
+def store(sketch, updated_at):
+    '''Record the sketch of a refresh'''
+    redis_client = shared_redis_client()
+    if redis_client is None:
+        return
+
+    try:
+        queue_store(redis_client.pipeline(), sketch, updated_at).execute()
+    except redis.RedisError as e:
+        print(f"Redis error while storing sketch: {e}")
+
+def archive_name(member):
+    '''Object name of a serialized sketch in the archive, the same on every upload'''
+    data = json.loads(member)
+    source = re.sub(r'[^A-Za-z0-9]+', '_', data["source"]).strip('_')
+    return f"sketch_{data['updated_at']}_{source}.json"
+
+def of_refresh(updated_at):
+    '''Map the archive name of each sketch recorded by the refresh at updated_at to it'''
+    redis_client = shared_redis_client()
+    if redis_client is None:
+        return {}
+
+    try:
+        members = redis_client.zrangebyscore(SKETCH_KEY, updated_at, updated_at)
+    except redis.RedisError as e:
+        print(f"Redis error while reading sketches: {e}")
+        return {}
+    return {archive_name(member): member for member in members}
+
+def quantiles(window=DEFAULT_WINDOW, values=DEFAULT_QUANTILES):
+    '''Temperature quantiles over a window as a (body, status code) pair'''
+    query, error = parse_query(window, values)
+    if error:
+        return error
+    redis_client = shared_redis_client()
+    if redis_client is None:
+        return UNAVAILABLE
+
+    seconds, parsed = query
+    try:
+        members = redis_client.zrangebyscore(SKETCH_KEY, *window_bounds(seconds))
+    except redis.RedisError as e:
+        print(f"Redis error while reading sketches: {e}")
+        return UNAVAILABLE
+
+    return summary(members, window, parsed), 200
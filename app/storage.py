@@ -5,14 +5,36 @@ import datetime
 from minio import Minio
 from minio.error import S3Error, InvalidResponseError
 from app import opensense
+from app import sketches
 
 MINIO_HOST = os.getenv('MINIO_HOST', 'localhost')
 MINIO_PORT = int(os.environ.get('MINIO_PORT', 9000))
 MINIO_ACCESS_KEY = os.environ.get('MINIO_ACCESS_KEY', 'minioadmin')
 MINIO_SECRET_KEY = os.environ.get('MINIO_SECRET_KEY', 'minioadmin')
 
-def store_temperature_data():
-    '''Function to upload temperature data to MinIO.'''
+def upload_sketches(client, bucket_name, updated_at):
+    '''Archive the sketch of the refresh at updated_at, so long windows can be merged
+    from the bucket after they leave Redis.
+
+    Objects are named after the refresh, so storing a reading twice overwrites its
+    sketch instead of counting the refresh twice.
+    '''
+    for name, sketch in sketches.of_refresh(updated_at).items():
+        sketch_bytes = sketch.encode('utf-8')
+        client.put_object(
+            bucket_name,
+            name,
+            io.BytesIO(sketch_bytes),
+            length=len(sketch_bytes),
+            content_type='application/json'
+        )
+
+def store_temperature_data(temperature_result=None, updated_at=None):
+    '''Function to upload temperature data to MinIO.
+
+    The current reading is fetched unless temperature_result is given. The sketch of
+    the refresh at updated_at, the time of that reading, is uploaded next to it.
+    '''
     try:
         client = Minio(f"{MINIO_HOST}:{MINIO_PORT}",
             access_key=MINIO_ACCESS_KEY,
@@ -32,7 +54,9 @@ def store_temperature_data():
         destination_file = f"temperature_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S%f')}.txt"
 
         # Get the temperature data - unpack the tuple
-        temperature_result, _ = opensense.get_temperature()
+        if temperature_result is None:
+            temperature_result, _, info = opensense.get_snapshot()
+            updated_at = info[0] if info else None
 
         text_bytes = temperature_result.encode('utf-8')
         text_stream = io.BytesIO(text_bytes)
@@ -54,6 +78,9 @@ def store_temperature_data():
             content_type='text/plain'
         )
 
+        if updated_at is not None:
+            upload_sketches(client, bucket_name, updated_at)
+
         return (f'Temperature data successfully uploaded as '
                 f'{destination_file} to bucket {bucket_name}\n')
 
@@ -0,0 +1,122 @@
+'''Fan-out of temperature snapshots over Redis pub/sub for the SSE stream'''
+import os
+import json
+import time
+import threading
+import redis
+from app.config import create_redis_client, WORKER_THREADS
+
+CHANNEL = "temperature_updates"
+KEEPALIVE = int(os.environ.get('STREAM_KEEPALIVE', 15))
+RECONNECT_DELAY = 5
+# Under Gunicorn every open stream holds a worker thread until it ends, so a worker
+# only takes fewer streams than it has threads and the rest stay free for probes
+MAX_STREAMS = min(int(os.environ.get('STREAM_MAX_CLIENTS', max(WORKER_THREADS // 4, 1))),
+                  WORKER_THREADS - 1)
+
+# Keep proxies such as ingress-nginx from buffering or caching the stream
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def snapshot_message(result, updated_at):
+    '''Serialize a snapshot for publishing on the updates channel'''
+    return json.dumps({"updated_at": updated_at, "result": result})
+
+def initial_event(result, _stats, info):
+    '''First event of a new stream from get_snapshot() output, or None without a snapshot'''
+    return {"updated_at": info[0], "result": result} if info else None
+
+def format_event(snapshot):
+    '''Render a snapshot dict as a Server-Sent Event'''
+    data = "".join(f"data: {line}\n" for line in snapshot["result"].splitlines())
+    return f"id: {snapshot['updated_at']}\nevent: temperature\n{data}\n"
+
+class Subscriber:
+    '''Relay snapshots from a single Redis subscription to every waiting client thread'''
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._snapshot = None
+        self._thread = None
+        self.closed = False
+
+    def start(self):
+        '''Start the listener thread of this process if it is not running'''
+        with self._condition:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def wait(self, last_id, timeout):
+        '''Block until a snapshot other than last_id arrives, or return None on timeout'''
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self.closed or (self._snapshot is not None
+                                        and self._snapshot["updated_at"] != last_id),
+                timeout
+            )
+            if self.closed or self._snapshot is None or self._snapshot["updated_at"] == last_id:
+                return None
+            return self._snapshot
+
+    def close(self):
+        '''Wake every waiting client for good, so their streams end, e.g. on shutdown'''
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def deliver(self, message):
+        '''Wake every waiting client with a published message'''
+        with self._condition:
+            self._snapshot = json.loads(message)
+            self._condition.notify_all()
+
+    def _run(self):
+        '''Listen on the updates channel, reconnecting after Redis errors'''
+        while True:
+            client, available = create_redis_client()
+            if not available:
+                time.sleep(RECONNECT_DELAY)
+                continue
+
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANNEL)
+                while True:
+                    message = pubsub.get_message(timeout=KEEPALIVE)
+                    if message:
+                        self.deliver(message["data"])
+            except redis.RedisError as e:
+                print(f"Redis error on {CHANNEL} subscription: {e}")
+                client.close()
+                time.sleep(RECONNECT_DELAY)
+
+SUBSCRIBER = Subscriber()
+_stream_slots = threading.BoundedSemaphore(max(MAX_STREAMS, 0))
+
+def acquire_stream():
+    '''Take a stream slot of this process without waiting; False when all are taken'''
+    return _stream_slots.acquire(blocking=False)  # pylint: disable=consider-using-with
+
+def release_stream():
+    '''Give a stream slot back once its response is closed'''
+    _stream_slots.release()
+
+def stream_events(initial=None):
+    '''Yield the initial snapshot, then every new one, with keepalive comments between'''
+    SUBSCRIBER.start()
+    last_id = None
+
+    if initial is not None:
+        last_id = initial["updated_at"]
+        yield format_event(initial)
+
+    while not SUBSCRIBER.closed:
+        snapshot = SUBSCRIBER.wait(last_id, KEEPALIVE)
+        if SUBSCRIBER.closed:
+            return
+        if snapshot is None:
+            yield ": keepalive\n\n"
+            continue
+
+        last_id = snapshot["updated_at"]
+        yield format_event(snapshot)
@@ -0,0 +1,70 @@
+'''Memory benchmark of one refresh: per-box footprint of decoded dicts vs the ReadingStore.
+
+Run with: PYTHONPATH=. python tests/benchmark_memory.py [number of boxes]
+'''
+import sys
+import json
+import random
+import tracemalloc
+from app import opensense
+
+SENSORS = [
+    ("Temperatur", "°C", "HDC1080"),
+    ("rel. Luftfeuchte", "%", "HDC1080"),
+    ("Luftdruck", "hPa", "BMP280"),
+    ("PM10", "µg/m³", "SDS 011"),
+    ("PM2.5", "µg/m³", "SDS 011"),
+]
+
+def synthetic_box(i):
+    '''A box shaped like the ones returned by the OpenSenseMap /boxes endpoint'''
+    created = f"2025-01-01T12:{i % 60:02d}:00.000Z"
+    return {
+        "_id": f"{i:024x}",
+        "name": f"Station {i}",
+        "exposure": "outdoor",
+        "model": "homeV2Wifi",
+        "grouptag": ["luftdaten"],
+        "createdAt": "2020-05-01T08:00:00.000Z",
+        "updatedAt": created,
+        "currentLocation": {
+            "type": "Point",
+            "coordinates": [random.uniform(-180, 180), random.uniform(-90, 90)],
+            "timestamp": "2020-05-01T08:00:00.000Z"
+        },
+        "lastMeasurementAt": created,
+        "sensors": [{
+            "_id": f"{i * 10 + n:024x}",
+            "title": title,
+            "unit": unit,
+            "sensorType": sensor_type,
+            "icon": "osem-thermometer",
+            "lastMeasurement": {"value": f"{random.uniform(-10, 40):.2f}", "createdAt": created}
+        } for n, (title, unit, sensor_type) in enumerate(SENSORS)]
+    }
+
+def measure(parse, body):
+    '''Bytes still held by the parsed result, and the peak while parsing'''
+    tracemalloc.start()
+    result = parse(body)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak
+
+def main(count):
+    '''Print the per-box footprint of both representations'''
+    random.seed(0)
+    body = json.dumps([synthetic_box(i) for i in range(count)]).encode("utf-8")
+    print(f"{count:,} boxes, {len(body) / count:,.0f} bytes of JSON per box")
+
+    runs = {
+        "dicts (json.loads)": lambda b: json.loads(b.decode("utf-8")),
+        "ReadingStore (parse_body)": lambda b: opensense.parse_body([b], "utf-8", False),
+    }
+    for name, parse in runs.items():
+        result, current, peak = measure(parse, body)
+        print(f"{name:28} retained {current / count:8,.0f} B/box   peak {peak / count:8,.0f} B/box")
+        del result
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
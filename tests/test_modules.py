@@ -1,14 +1,40 @@
 '''This module contains tests for the Flask and OpenSense modules.'''
 import re
+import os
+import json
+import asyncio
+import time
+import tempfile
+import threading
 import unittest
 import unittest.mock as mock
+from concurrent.futures import ThreadPoolExecutor
 import requests  # added
 import redis     # added
+import urllib3
+import httpx
+from flask import Flask
+from prometheus_client import REGISTRY, Counter, Gauge, values
 from minio.error import S3Error, InvalidResponseError
 from app.storage import store_temperature_data
 from app.main import app
+from app.asgi import app as asgi_app
 from app import opensense
 from app import readiness
+from app import async_opensense
+from app import http_cache
+from app import updates
+from app import boxes
+from app import sketches
+from app import readings
+from app import profiling
+from app import admission
+from app import archiver
+from app import async_admission
+from app import async_updates
+from app import gunicorn_conf
+from app import config
+from app import exposition
 
 class TestFlaskApp(unittest.TestCase):
     """Test cases for Flask application endpoints"""
@@ -39,6 +65,108 @@ class TestFlaskApp(unittest.TestCase):
             response = self.client.get('/temperature')
             self.assertIn(response.status_code, [200, 500])
 
+    def test_temperature_caching_headers(self):
+        """Test temperature endpoint sends validators and the remaining TTL"""
+        with mock.patch('app.opensense.get_snapshot',
+                        return_value=("temp\n", {}, (1700000000, 120))):
+            response = self.client.get('/temperature')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], 'W/"1700000000"')
+        self.assertIn('max-age=120', response.headers['Cache-Control'])
+        self.assertIn('Last-Modified', response.headers)
+
+    def test_temperature_not_modified(self):
+        """Test temperature endpoint answers a matching If-None-Match with 304"""
+        with mock.patch('app.opensense.get_snapshot',
+                        return_value=("temp\n", {}, (1700000000, 120))):
+            response = self.client.get('/temperature',
+                                       headers={'If-None-Match': 'W/"1700000000"'})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b"")
+
+    def test_temperature_without_snapshot(self):
+        """Test temperature endpoint disables caching when nothing is cached"""
+        with mock.patch('app.opensense.get_snapshot', return_value=("temp\n", {}, None)):
+            response = self.client.get('/temperature',
+                                       headers={'If-None-Match': 'W/"1700000000"'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        self.assertNotIn('ETag', response.headers)
+
+    def test_temperature_stream_endpoint(self):
+        """Test the stream opens with the current snapshot as an event"""
+        with mock.patch('app.opensense.get_snapshot',
+                        return_value=("temp\n", {}, (1700000000, 120))), \
+             mock.patch('app.updates.SUBSCRIBER'):
+            response = self.client.get('/temperature/stream', buffered=False)
+            first_event = next(response.response).decode("utf-8")
+            response.close()
+
+        # Closing the response gives the stream slot back
+        self.assertTrue(updates.acquire_stream())
+        updates.release_stream()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/event-stream")
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        self.assertIn("id: 1700000000", first_event)
+        self.assertIn("data: temp", first_event)
+
+    def test_temperature_stream_limit(self):
+        """Test streams beyond the per-worker cap are shed before taking a thread"""
+        with mock.patch('app.updates.acquire_stream', return_value=False), \
+             mock.patch('app.opensense.get_snapshot') as mock_snapshot:
+            response = self.client.get('/temperature/stream')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+        mock_snapshot.assert_not_called()
+
+    def test_boxes_health_endpoint(self):
+        """Test boxes health endpoint passes the stale window through"""
+        with mock.patch('app.boxes.health',
+                        return_value=({"boxes": 2}, 200)) as mock_health:
+            response = self.client.get('/boxes/health?stale_minutes=30')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["boxes"], 2)
+        mock_health.assert_called_once_with(30)
+
+    def test_quantiles_endpoint(self):
+        """Test quantiles endpoint merges the sketches of the window"""
+        sketch = sketches.TDigest()
+        for value in range(101):
+            sketch.add(value)
+        mock_redis_client = mock.MagicMock()
+        mock_redis_client.zrangebyscore.return_value = [sketches.sketch_member(sketch, 1)] * 2
+
+        with mock.patch('app.sketches.shared_redis_client', return_value=mock_redis_client):
+            response = self.client.get('/temperature/quantiles?window=7d&q=0.5')
+
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual(body["sketches"], 2)
+        self.assertEqual(body["readings"], 202)
+        self.assertAlmostEqual(body["quantiles"]["p50"], 50, delta=1)
+
+    def test_quantiles_endpoint_invalid_window(self):
+        """Test quantiles endpoint rejects windows beyond the retention"""
+        response = self.client.get('/temperature/quantiles?window=30d')
+        self.assertEqual(response.status_code, 400)
+
+    def test_box_status_endpoint_unknown(self):
+        """Test box status endpoint returns 404 for boxes not in the index"""
+        mock_redis_client = mock.MagicMock()
+        mock_redis_client.zscore.return_value = None
+
+        with mock.patch('app.boxes.shared_redis_client', return_value=mock_redis_client):
+            response = self.client.get('/boxes/abc123')
+
+        self.assertEqual(response.status_code, 404)
+
     def test_metrics_endpoint(self):
         """Test metrics endpoint returns 200"""
         response = self.client.get('/metrics')
@@ -79,6 +207,19 @@ class MockOpenSenseResponse:
     def __init__(self, temp_value):
         self.text = "mock response text"
         self.temp_value = temp_value
+        self.encoding = "utf-8"
+
+    def raise_for_status(self):
+        """Mock a successful status."""
+
+    def iter_content(self, chunk_size):
+        """Stream the JSON body in chunks."""
+        body = json.dumps(self.json()).encode("utf-8")
+        for i in range(0, len(body), chunk_size):
+            yield body[i:i + chunk_size]
+
+    def close(self):
+        """Mock closing the stream."""
 
     def json(self):
         """Return a mock JSON response."""
@@ -134,36 +275,756 @@ class TestOpenSense(unittest.TestCase):
     def test_cache_hit(self):
         """Test that cached data is returned when available"""
         mock_redis_client = mock.MagicMock()
-        mock_redis_client.get.return_value = "cached_result"
+        pipe = mock_redis_client.pipeline.return_value
+        pipe.execute.return_value = ["cached_result", "1700000000", 42]
 
         with mock.patch('app.opensense.REDIS_AVAILABLE', True), \
              mock.patch('app.opensense.redis_client', mock_redis_client), \
              mock.patch('app.opensense.requests.get') as mock_requests:
 
-            result, _ = opensense.get_temperature()
+            result, _, info = opensense.get_snapshot()
             self.assertEqual(result, "cached_result")
+            self.assertEqual(info, (1700000000, 42))
             mock_requests.assert_not_called()
-            mock_redis_client.get.assert_called_once_with("temperature_data")
+            pipe.get.assert_any_call("temperature_data")
+            pipe.execute.assert_called_once()
 
     def test_cache_miss_and_store(self):
         """Test that data is fetched and cached on cache miss"""
         mock_redis_client = mock.MagicMock()
-        mock_redis_client.get.return_value = None
+        pipe = mock_redis_client.pipeline.return_value
+        pipe.execute.return_value = [None, None, -2]
 
         with mock.patch('app.opensense.REDIS_AVAILABLE', True), \
              mock.patch('app.opensense.redis_client', mock_redis_client), \
              mock.patch('app.opensense.requests.get',
                        return_value=MockOpenSenseResponse(25)):
 
-            result, _ = opensense.get_temperature()
+            result, _, info = opensense.get_snapshot()
             self.assertIn('Average temperature', result)
-            mock_redis_client.setex.assert_called()
+            self.assertEqual(info[1], opensense.CACHE_TTL)
+            # All keys are written in one transaction
+            mock_redis_client.setex.assert_not_called()
+            self.assertEqual(pipe.setex.call_count, 3)
+            # Read before and after admission, then one write
+            self.assertEqual(pipe.execute.call_count, 3)
             # Verify cache key and TTL
-            call_args = mock_redis_client.setex.call_args
+            call_args = pipe.setex.call_args_list[0]
             self.assertEqual(call_args[0][0], "temperature_data")
             self.assertGreater(call_args[0][1], 0)  # TTL should be positive
 
 
+class TestHttpCache(unittest.TestCase):
+    """Test cases for the conditional caching helpers"""
+
+    def setUp(self):
+        """Set up headers for a cached snapshot"""
+        self.headers = http_cache.snapshot_headers((1700000000, 60))
+
+    def test_if_none_match(self):
+        """Matching and stale entity tags"""
+        self.assertTrue(http_cache.not_modified(
+            {"If-None-Match": 'W/"1700000000"'}, self.headers))
+        self.assertTrue(http_cache.not_modified(
+            {"If-None-Match": '"1700000000", "other"'}, self.headers))
+        self.assertFalse(http_cache.not_modified(
+            {"If-None-Match": 'W/"1699999700"'}, self.headers))
+
+    def test_if_modified_since(self):
+        """Dates at or after Last-Modified are not modified"""
+        self.assertTrue(http_cache.not_modified(
+            {"If-Modified-Since": self.headers["Last-Modified"]}, self.headers))
+        self.assertFalse(http_cache.not_modified(
+            {"If-Modified-Since": "Tue, 14 Nov 2023 22:00:00 GMT"}, self.headers))
+
+    def test_parse_snapshot(self):
+        """Snapshot info combines the timestamp key and the data TTL of the same read"""
+        self.assertEqual(opensense.parse_snapshot("body", "1700000000", 42),
+                         ("body", (1700000000, 42)))
+        self.assertEqual(opensense.parse_snapshot("body", None, 42), ("body", None))
+        self.assertEqual(opensense.parse_snapshot(None, None, -2), (None, None))
+
+
+class TestUpdates(unittest.TestCase):
+    """Test cases for the snapshot update stream"""
+
+    def test_format_event(self):
+        """Every line of the result becomes a data field"""
+        event = updates.format_event({"updated_at": 1, "result": "a\nb\n"})
+        self.assertEqual(event, "id: 1\nevent: temperature\ndata: a\ndata: b\n\n")
+
+    def test_subscriber_wait(self):
+        """Waiting returns delivered snapshots once and None when nothing is new"""
+        subscriber = updates.Subscriber()
+        self.assertIsNone(subscriber.wait(None, 0.01))
+
+        subscriber.deliver(updates.snapshot_message("temp", 5))
+        self.assertEqual(subscriber.wait(None, 0.01), {"updated_at": 5, "result": "temp"})
+        self.assertIsNone(subscriber.wait(5, 0.01))
+
+    def test_stream_events(self):
+        """The stream yields the initial snapshot, keepalives, then new snapshots"""
+        with mock.patch('app.updates.SUBSCRIBER') as mock_subscriber:
+            mock_subscriber.closed = False
+            mock_subscriber.wait.side_effect = [None, {"updated_at": 2, "result": "new"}]
+            events = updates.stream_events({"updated_at": 1, "result": "old"})
+
+            self.assertIn("data: old", next(events))
+            self.assertEqual(next(events), ": keepalive\n\n")
+            self.assertIn("data: new", next(events))
+            mock_subscriber.wait.assert_called_with(1, updates.KEEPALIVE)
+
+    def test_stream_ends_on_close(self):
+        """Closing the subscriber wakes waiting streams and ends them"""
+        subscriber = updates.Subscriber()
+        with mock.patch('app.updates.SUBSCRIBER', subscriber), \
+             mock.patch.object(subscriber, 'start'):
+            events = updates.stream_events({"updated_at": 1, "result": "old"})
+            next(events)
+            threading.Timer(0.05, subscriber.close).start()
+
+            started = time.monotonic()
+            self.assertEqual(list(events), [])
+            self.assertLess(time.monotonic() - started, updates.KEEPALIVE)
+
+    def test_stream_slots_below_threads(self):
+        """Streams never get every thread of a worker"""
+        self.assertLess(updates.MAX_STREAMS, gunicorn_conf.threads)
+
+    def test_cache_refresh_publishes(self):
+        """A refresh publishes the new snapshot on the updates channel"""
+        mock_redis_client = mock.MagicMock()
+        mock_redis_client.pipeline.return_value.execute.return_value = [None, None, -2]
+
+        with mock.patch('app.opensense.REDIS_AVAILABLE', True), \
+             mock.patch('app.opensense.redis_client', mock_redis_client), \
+             mock.patch('app.opensense.requests.get',
+                        return_value=MockOpenSenseResponse(25)):
+            result, _ = opensense.get_temperature()
+
+        channel, message = mock_redis_client.pipeline.return_value.publish.call_args[0]
+        self.assertEqual(channel, updates.CHANNEL)
+        self.assertEqual(json.loads(message)["result"], result)
+
+
+class TestAsyncUpdates(unittest.IsolatedAsyncioTestCase):
+    """Test cases for the async snapshot update stream"""
+
+    async def test_deliver_keeps_latest(self):
+        """Slow clients only keep the most recent snapshot"""
+        subscriber = async_updates.AsyncSubscriber()
+        with mock.patch.object(subscriber, '_run', new=mock.AsyncMock()):
+            queue = subscriber.listen()
+            subscriber.deliver(updates.snapshot_message("first", 1))
+            subscriber.deliver(updates.snapshot_message("second", 2))
+
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(queue.get_nowait()["result"], "second")
+        subscriber.remove(queue)
+
+    async def test_stream_events(self):
+        """The stream skips a published copy of the initial snapshot"""
+        queue = asyncio.Queue()
+        queue.put_nowait({"updated_at": 1, "result": "old"})
+        queue.put_nowait({"updated_at": 2, "result": "new"})
+
+        with mock.patch('app.async_updates.SUBSCRIBER') as mock_subscriber:
+            mock_subscriber.listen.return_value = queue
+            events = async_updates.stream_events({"updated_at": 1, "result": "old"})
+
+            self.assertIn("data: old", await anext(events))
+            self.assertIn("data: new", await anext(events))
+            await events.aclose()
+            mock_subscriber.remove.assert_called_once_with(queue)
+
+
+class TestBoxes(unittest.TestCase):
+    """Test cases for the per-box last-seen index"""
+
+    def test_last_seen(self):
+        """The latest of box and sensor measurement times is indexed"""
+        data = [
+            {"_id": "a", "lastMeasurementAt": "2024-01-01T00:00:00.000Z",
+             "sensors": [{"lastMeasurement": {"createdAt": "2024-01-01T00:05:00.000Z"}}]},
+            {"_id": "b", "sensors": [{"lastMeasurement": None}]},
+            {"_id": "c", "lastMeasurementAt": "not a date"},
+            "garbage",
+        ]
+        self.assertEqual(boxes.last_seen(data), {"a": 1704067500.0})
+
+    def test_queue_index_update(self):
+        """Boxes only move forward and expired ones are trimmed"""
+        pipe = mock.MagicMock()
+        data = [{"_id": "a", "lastMeasurementAt": "2024-01-01T00:00:00Z"}]
+
+        boxes.queue_index_update(pipe, data, now=2000000000)
+
+        pipe.zadd.assert_called_once_with(boxes.BOX_INDEX_KEY, {"a": 1704067200.0}, gt=True)
+        pipe.zremrangebyscore.assert_called_once_with(
+            boxes.BOX_INDEX_KEY, '-inf', 2000000000 - boxes.BOX_INDEX_RETENTION)
+
+    def test_health(self):
+        """Health counts boxes seen inside the stale window as reachable"""
+        mock_redis_client = mock.MagicMock()
+        mock_redis_client.pipeline.return_value.execute.return_value = [4, 3]
+
+        with mock.patch('app.boxes.shared_redis_client', return_value=mock_redis_client):
+            body, status_code = boxes.health(stale_minutes=10)
+
+        self.assertEqual(status_code, 200)
+        self.assertEqual(body["stale"], 1)
+        self.assertEqual(body["reachable_percentage"], 75.0)
+
+    def test_health_redis_unavailable(self):
+        """Health is reported unavailable without Redis"""
+        with mock.patch('app.boxes.shared_redis_client', return_value=None):
+            self.assertEqual(boxes.health()[1], 503)
+
+    def test_box_status(self):
+        """A box is stale once its last measurement leaves the window"""
+        body, status_code = boxes.box_status("a", 1000, 10, now=1000 + 601)
+        self.assertEqual(status_code, 200)
+        self.assertTrue(body["stale"])
+        self.assertEqual(body["last_seen"], "1970-01-01T00:16:40+00:00")
+
+        body, _ = boxes.box_status("a", 1000, 10, now=1000 + 599)
+        self.assertFalse(body["stale"])
+
+    def test_null_count_per_box(self):
+        """Unreachable boxes are counted once, whatever their sensor count"""
+        data = [
+            {"sensors": [{"unit": "°C", "lastMeasurement": None},
+                         {"unit": "°C", "lastMeasurement": {"value": "x"}}]},
+            {"sensors": [{"unit": "°C", "lastMeasurement": None},
+                         {"unit": "°C", "lastMeasurement": {"value": "20"}}]},
+            {"sensors": [{"unit": "%", "lastMeasurement": {"value": "50"}}]},
+        ]
+        _, stats = opensense.summarize(data)
+        self.assertEqual(stats["total_sensors"], 3)
+        self.assertEqual(stats["null_count"], 1)
+
+
+class TestReadings(unittest.TestCase):
+    """Test cases for the compact reading store"""
+
+    def test_store_keeps_needed_fields(self):
+        """Box id, location, readings and times are kept in typed arrays"""
+        store = readings.ReadingStore.from_boxes([
+            {"_id": "a", "currentLocation": {"coordinates": [13.4, 52.5]},
+             "lastMeasurementAt": "2024-01-01T00:00:00Z",
+             "sensors": [{"unit": "°C", "lastMeasurement":
+                          {"value": "21.5", "createdAt": "2024-01-01T00:05:00Z"}},
+                         {"unit": "%", "lastMeasurement": {"value": "40"}}]},
+            {"_id": "b", "sensors": [{"unit": "°C", "lastMeasurement": None}]},
+            {"_id": "c"},
+            "garbage",
+        ])
+
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.box_ids, ["a", "b", "c"])
+        self.assertEqual((store.longitude[0], store.latitude[0]), (13.4, 52.5))
+        self.assertEqual(list(store.values), [21.5])
+        self.assertEqual(list(store.reading_box), [0])
+        self.assertEqual(list(store.reading_time), [1704067500.0])
+        self.assertEqual(list(store.state), [readings.REPORTING, readings.UNREACHABLE,
+                                             readings.NO_SENSORS])
+        self.assertEqual(store.box_last_seen(), {"a": 1704067500.0})
+
+    def test_parse_body_builds_store(self):
+        """Complete and truncated bodies are parsed box by box into a store"""
+        body = json.dumps([{"_id": "a", "sensors": []}, {"_id": "b", "sensors": []}])
+
+        store = opensense.parse_body([body.encode()], "utf-8", False)
+        self.assertIsInstance(store, readings.ReadingStore)
+        self.assertEqual(store.box_ids, ["a", "b"])
+
+        store = opensense.parse_body([body[:-10].encode()], "utf-8", True)
+        self.assertEqual(store.box_ids, ["a"])
+
+    def test_parse_body_edge_cases(self):
+        """Empty lists parse to an empty store, unparseable bodies to None"""
+        self.assertEqual(len(opensense.parse_body([b"[ ]"], None, False)), 0)
+        self.assertEqual(len(opensense.parse_body([b'{"error": "x"}'], None, False)), 0)
+        self.assertIsNone(opensense.parse_body([b"<html>"], None, False))
+        self.assertIsNone(opensense.parse_body([b'[{"_id": '], None, True))
+
+
+class TestSketches(unittest.TestCase):
+    """Test cases for the mergeable temperature sketches"""
+
+    def test_quantiles_close_to_exact(self):
+        """Quantiles stay close to the exact ones with a bounded number of centroids"""
+        values = [(i * 7919) % 10000 / 100 for i in range(10000)]
+        sketch = sketches.TDigest()
+        for value in values:
+            sketch.add(value)
+
+        self.assertLessEqual(len(sketch.to_dict()["centroids"]), sketch.compression)
+        self.assertAlmostEqual(sketch.quantile(0.5), 50, delta=1)
+        self.assertAlmostEqual(sketch.quantile(0.99), 99, delta=0.2)
+        self.assertEqual(sketch.quantile(0), 0)
+        self.assertEqual(sketch.quantile(1), 99.99)
+
+    def test_merge_matches_single_sketch(self):
+        """Sketches merged across refreshes answer like one sketch of every reading"""
+        members = []
+        for start in range(0, 1000, 100):
+            part = sketches.TDigest()
+            for value in range(start, start + 100):
+                part.add(value)
+            members.append(sketches.sketch_member(part, start))
+
+        merged = sketches.merge_members(members)
+        self.assertEqual(merged.count, 1000)
+        self.assertAlmostEqual(merged.quantile(0.95), 950, delta=5)
+
+    def test_empty_sketch(self):
+        """An empty sketch has no quantiles and is not stored"""
+        pipe = mock.MagicMock()
+        self.assertIsNone(sketches.TDigest().quantile(0.5))
+
+        sketches.queue_store(pipe, sketches.TDigest(), 1, now=2000000000)
+
+        pipe.zadd.assert_not_called()
+        pipe.zremrangebyscore.assert_called_once_with(
+            sketches.SKETCH_KEY, '-inf', 2000000000 - sketches.SKETCH_RETENTION)
+
+    def test_parse_query(self):
+        """Windows and quantiles are validated"""
+        self.assertEqual(sketches.parse_window("24h"), 86400)
+        self.assertEqual(sketches.parse_window("90"), 90)
+        self.assertIsNone(sketches.parse_window("h"))
+        self.assertIsNone(sketches.parse_window("-1d"))
+        self.assertEqual(sketches.parse_query("7d", "0.5,0.95")[0], (604800, [0.5, 0.95]))
+        self.assertEqual(sketches.parse_query("7d", "95")[1][1], 400)
+
+    def test_summarize_fills_sketch(self):
+        """Every valid reading of a refresh goes into its sketch"""
+        data = [{"sensors": [{"unit": "°C", "lastMeasurement": {"value": "20"}},
+                             {"unit": "°C", "lastMeasurement": {"value": "x"}}]},
+                {"sensors": [{"unit": "°C", "lastMeasurement": {"value": "30"}}]}]
+        sketch = sketches.TDigest()
+
+        opensense.summarize(data, sketch)
+
+        self.assertEqual(sketch.count, 2)
+        self.assertEqual((sketch.min, sketch.max), (20, 30))
+
+    def test_quantiles_redis_unavailable(self):
+        """Quantiles are reported unavailable without Redis"""
+        with mock.patch('app.sketches.shared_redis_client', return_value=None):
+            self.assertEqual(sketches.quantiles()[1], 503)
+
+
+class TestProfiling(unittest.TestCase):
+    """Test cases for the opt-in request profiler"""
+
+    def setUp(self):
+        """Use a temporary profile directory and a fresh app"""
+        self.tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.patches = [
+            mock.patch('app.profiling.PROFILE_DIR', self.tmpdir.name),
+            mock.patch('app.profiling.PROFILING_ENABLED', True),
+            mock.patch('app.profiling.PROFILING_TOKEN', 'secret'),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+        self.app = Flask(__name__)
+        self.app.add_url_rule('/work', 'work', self._work)
+        profiling.init_app(self.app)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        """Stop the patches and remove the profiles"""
+        for patch in self.patches:
+            patch.stop()
+        self.tmpdir.cleanup()
+
+    @staticmethod
+    def _work():
+        """Route spending its time inside a stage"""
+        with profiling.stage("aggregate"):
+            time.sleep(0.05)
+        return "done"
+
+    def test_sample_includes_stages(self):
+        """Samples are prefixed with the label and the active stages"""
+        profile = profiling.Profile("GET /x")
+        profiling._local.profile = profile  # pylint: disable=protected-access
+        try:
+            with profiling.stage("network"):
+                profile.sample()
+        finally:
+            profiling._local.profile = None  # pylint: disable=protected-access
+
+        stack = next(iter(profile.stacks))
+        self.assertTrue(stack.startswith("GET /x;stage:network;"))
+        self.assertIn("test_sample_includes_stages", stack)
+
+    def test_stage_without_profile(self):
+        """Stages are plain no-ops when the request is not profiled"""
+        with profiling.stage("network"):
+            pass
+
+    def test_profiled_request_writes_profile(self):
+        """Requests with the profile header and the token produce a downloadable profile"""
+        auth = {'Authorization': 'Bearer secret'}
+        self.client.get('/work', headers={profiling.PROFILE_HEADER: '1', **auth})
+        self.client.get('/work')
+        self.client.get('/work', headers={profiling.PROFILE_HEADER: '1'})
+
+        names = self.client.get('/profiles', headers=auth).get_json()
+        self.assertEqual(len(names), 1)
+
+        body = self.client.get(f'/profiles/{names[0]}', headers=auth).get_data(as_text=True)
+        self.assertIn("GET /work;stage:aggregate;", body)
+
+    def test_profile_names_unique(self):
+        """Profiles of one route finishing in the same second do not overwrite each other"""
+        with mock.patch('app.profiling.time.strftime', return_value="20260101_000000"):
+            first = profiling.write_profile(profiling.Profile("GET /x"))
+            second = profiling.write_profile(profiling.Profile("GET /x"))
+
+        self.assertNotEqual(first, second)
+        self.assertEqual(len(profiling.list_profiles()), 2)
+
+    def test_profile_endpoints_require_token(self):
+        """Profile endpoints reject requests without the bearer token"""
+        self.assertEqual(self.client.get('/profiles').status_code, 401)
+        self.assertEqual(self.client.get(
+            '/profiles', headers={'Authorization': 'Bearer wrong'}).status_code, 401)
+
+    def test_disabled_registers_nothing(self):
+        """Without PROFILING_ENABLED no hooks or endpoints are added"""
+        disabled_app = Flask(__name__)
+        with mock.patch('app.profiling.PROFILING_ENABLED', False):
+            profiling.init_app(disabled_app)
+
+        self.assertEqual(disabled_app.before_request_funcs, {})
+        self.assertEqual(disabled_app.test_client().get('/profiles').status_code, 404)
+
+
+class TestAdmission(unittest.TestCase):
+    """Test cases for admission control"""
+
+    def setUp(self):
+        """Set up test client"""
+        self.client = app.test_client()
+
+    def test_limiter_queue_full(self):
+        """Requests beyond the slots and the queue are shed immediately"""
+        limiter = admission.Limiter("test_full", concurrency=1, queue=0, timeout=1)
+        labels = {"route": "test_full", "reason": "queue_full"}
+        before = REGISTRY.get_sample_value('hivebox_requests_shed_total', labels) or 0
+
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire())
+        limiter.release()
+        self.assertTrue(limiter.acquire())
+
+        after = REGISTRY.get_sample_value('hivebox_requests_shed_total', labels)
+        self.assertEqual(after - before, 1)
+
+    def test_limiter_queue_timeout(self):
+        """Queued requests are shed when no slot frees up in time"""
+        limiter = admission.Limiter("test_timeout", concurrency=1, queue=1, timeout=0.01)
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire())
+
+    def test_limiter_queued_request_admitted(self):
+        """Queued requests get the slot once it is released"""
+        limiter = admission.Limiter("test_queue", concurrency=1, queue=1, timeout=5)
+        self.assertTrue(limiter.acquire())
+        timer = threading.Timer(0.05, limiter.release)
+        timer.start()
+        self.assertTrue(limiter.acquire())
+        timer.join()
+
+    def test_store_shed(self):
+        """Shed /store requests get a 503 with Retry-After"""
+        with mock.patch.object(admission.LIMITERS['store'], 'acquire', return_value=False):
+            response = self.client.get('/store')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], str(admission.RETRY_AFTER))
+
+    def test_temperature_shed_serves_stale(self):
+        """Shed cache misses of /temperature get the last result when there is one"""
+        with mock.patch.object(admission.LIMITERS['temperature'], 'acquire',
+                               return_value=False), \
+             mock.patch('app.opensense.read_snapshot', return_value=None), \
+             mock.patch('app.opensense.stale_result', return_value="old\n"):
+            response = self.client.get('/temperature')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("old", response.get_data(as_text=True))
+        self.assertIn("Stale", response.headers['Warning'])
+
+        with mock.patch.object(admission.LIMITERS['temperature'], 'acquire',
+                               return_value=False), \
+             mock.patch('app.opensense.read_snapshot', return_value=None), \
+             mock.patch('app.opensense.stale_result', return_value=None):
+            response = self.client.get('/temperature')
+
+        self.assertEqual(response.status_code, 503)
+
+    def test_cache_hit_never_shed(self):
+        """Cache hits are answered fresh even when no refresh can be admitted"""
+        with mock.patch.object(admission.LIMITERS['temperature'], 'acquire',
+                               return_value=False), \
+             mock.patch('app.opensense.read_snapshot',
+                        return_value=("temp\n", {}, (1700000000, 120))):
+            response = self.client.get('/temperature')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Warning', response.headers)
+
+    def test_single_flight(self):
+        """Threads asking while a call is in flight share its result"""
+        flight = admission.SingleFlight()
+        calls = []
+
+        def refresh():
+            calls.append(1)
+            time.sleep(0.1)
+            return len(calls)
+
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            results = list(pool.map(lambda _: flight.run(refresh), range(5)))
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, [1] * 5)
+
+    def test_readyz_shed_repeats_last_status(self):
+        """Shed probes repeat the last readiness result"""
+        with mock.patch.object(admission.LIMITERS['readyz'], 'acquire', return_value=False), \
+             mock.patch('app.readiness.last_status', return_value=503):
+            response = self.client.get('/readyz')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.get_json()['status'], 'not ready')
+
+    def test_limits_leave_probe_threads(self):
+        """Admitted and queued requests and streams leave a Gunicorn thread free"""
+        held = sum(concurrency + queue for concurrency, queue in admission.ROUTE_LIMITS.values())
+        self.assertLessEqual(held + updates.MAX_STREAMS,
+                             gunicorn_conf.threads - admission.PROBE_THREADS)
+        self.assertGreater(admission.ROUTE_LIMITS["temperature"][1], 0)
+
+    def test_overload_under_worker_threads(self):
+        """Misses waiting for a slow refresh are queued then shed while /version
+        still gets a thread"""
+        refreshes = []
+
+        def slow_refresh():
+            refreshes.append(1)
+            time.sleep(0.3)
+            return "temp\n", {}, (1700000000, 120)
+
+        def get(path):
+            started = time.monotonic()
+            response = app.test_client().get(path)
+            return response.status_code, time.monotonic() - started
+
+        with mock.patch('app.opensense.read_snapshot', return_value=None), \
+             mock.patch('app.opensense.refresh_snapshot', side_effect=slow_refresh), \
+             mock.patch('app.opensense.stale_result', return_value=None), \
+             ThreadPoolExecutor(max_workers=gunicorn_conf.threads) as pool:
+            submitted = time.monotonic()
+            fetches = [pool.submit(get, '/temperature') for _ in range(2 * gunicorn_conf.threads)]
+            version = pool.submit(get, '/version').result()
+            version_latency = time.monotonic() - submitted
+            statuses = [fetch.result()[0] for fetch in fetches]
+
+        concurrency, queue = admission.ROUTE_LIMITS["temperature"]
+        self.assertEqual(version[0], 200)
+        self.assertLess(version_latency, 0.3)
+        self.assertEqual(statuses.count(200), concurrency + queue)
+        self.assertEqual(statuses.count(503), len(statuses) - concurrency - queue)
+        # The admitted misses share refreshes instead of each fetching upstream
+        self.assertLess(len(refreshes), concurrency + queue)
+
+
+class TestAsyncAdmission(unittest.IsolatedAsyncioTestCase):
+    """Test cases for async admission control"""
+
+    async def test_limiter(self):
+        """The async limiter queues, admits and sheds like the sync one"""
+        limiter = async_admission.AsyncLimiter("test_async", concurrency=1, queue=1,
+                                               timeout=0.05)
+        self.assertTrue(await limiter.acquire())
+        self.assertFalse(await limiter.acquire())
+
+        asyncio.get_running_loop().call_later(0.01, limiter.release)
+        self.assertTrue(await limiter.acquire())
+        limiter.release()
+
+    def test_limits_independent_of_threads(self):
+        """The ASGI app lets far more cache misses wait than a Gunicorn worker"""
+        concurrency, queue = async_admission.ROUTE_LIMITS["temperature"]
+        self.assertGreater(concurrency + queue, 10 * gunicorn_conf.threads)
+
+    async def test_single_flight(self):
+        """Tasks asking while a call is in flight share its result"""
+        flight = async_admission.AsyncSingleFlight()
+        calls = []
+
+        async def refresh():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return len(calls)
+
+        results = await asyncio.gather(*(flight.run(refresh) for _ in range(5)))
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, [1] * 5)
+
+    async def test_overload_cache_hits(self):
+        """A burst of cache hits is answered fresh, none is shed"""
+        async def slow_read():
+            await asyncio.sleep(0.05)
+            return "temp\n", {}, (1700000000, 120)
+
+        client = asgi_app.test_client()
+        with mock.patch('app.async_opensense.read_snapshot', side_effect=slow_read), \
+             mock.patch('app.async_opensense.stale_result', return_value=None):
+            responses = await asyncio.gather(*(client.get('/temperature') for _ in range(50)))
+
+        self.assertEqual([r.status_code for r in responses], [200] * 50)
+        self.assertFalse(any('Warning' in r.headers for r in responses))
+
+    async def test_overload_cache_misses(self):
+        """A burst of cache misses waits for a single upstream refresh"""
+        refreshes = []
+
+        async def slow_refresh():
+            refreshes.append(1)
+            await asyncio.sleep(0.1)
+            return "temp\n", {}, (1700000000, 120)
+
+        client = asgi_app.test_client()
+        with mock.patch('app.async_opensense.read_snapshot', return_value=None), \
+             mock.patch('app.async_opensense.refresh_snapshot', side_effect=slow_refresh), \
+             mock.patch('app.async_opensense.stale_result', return_value=None):
+            responses = await asyncio.gather(*(client.get('/temperature') for _ in range(50)))
+
+        self.assertEqual([r.status_code for r in responses], [200] * 50)
+        self.assertEqual(refreshes, [1])
+
+
+class TestArchiver(unittest.TestCase):
+    """Test cases for the scheduled archiver and its leader lease"""
+
+    def setUp(self):
+        """Set up an archiver on a mocked Redis client"""
+        self.archiver = archiver.Archiver(interval=300, lease_ttl=30)
+        self.archiver.identity = "pod-a"
+        self.archiver.redis_client = mock.MagicMock()
+        self.pipe = self.archiver.redis_client.pipeline.return_value
+
+    def test_hold_lease(self):
+        """The lease is taken when free, renewed when ours and refused otherwise"""
+        client = self.archiver.redis_client
+        client.set.return_value = True
+        self.assertTrue(self.archiver.hold_lease())
+        client.set.assert_called_with(archiver.LEADER_KEY, "pod-a", nx=True, ex=30)
+
+        client.set.return_value = None
+        client.eval.return_value = 1
+        self.assertTrue(self.archiver.hold_lease())
+        client.eval.assert_called_with(archiver.RENEW_SCRIPT, 1, archiver.LEADER_KEY, "pod-a", 30)
+
+        client.eval.return_value = 0
+        self.assertFalse(self.archiver.hold_lease())
+
+    def test_tick_archives_once_per_interval(self):
+        """The leader archives the cached snapshot, then waits for the interval"""
+        self.archiver.redis_client.set.return_value = True
+        self.pipe.execute.return_value = ["reading\n", "1700000000", None]
+
+        with mock.patch('app.archiver.storage.store_temperature_data',
+                        return_value="Temperature data successfully uploaded") as mock_store:
+            self.archiver.tick(now=1000)
+            self.archiver.tick(now=1100)
+
+        mock_store.assert_called_once_with("reading\n", "1700000000")
+        self.archiver.redis_client.eval.assert_any_call(
+            archiver.MARK_SCRIPT, 1, archiver.LAST_ARCHIVED_KEY, "1700000000")
+
+    def test_tick_not_leader(self):
+        """Followers never archive"""
+        self.archiver.redis_client.set.return_value = None
+        self.archiver.redis_client.eval.return_value = 0
+
+        with mock.patch('app.archiver.storage.store_temperature_data') as mock_store:
+            self.assertIsNone(self.archiver.tick(now=1000))
+
+        mock_store.assert_not_called()
+
+    def test_archive_snapshot_skips_archived(self):
+        """Snapshots no newer than the last archived one, e.g. by a previous leader,
+        are skipped"""
+        with mock.patch('app.archiver.storage.store_temperature_data') as mock_store:
+            for updated_at in ("1700000000", "1699999700"):
+                self.pipe.execute.return_value = ["reading\n", updated_at, "1700000000"]
+                self.assertIsNone(self.archiver.archive_snapshot())
+
+        mock_store.assert_not_called()
+
+    def test_archive_snapshot_failure_is_retried(self):
+        """A failed upload does not mark the snapshot as archived"""
+        self.pipe.execute.return_value = ["reading\n", "1700000000", None]
+
+        with mock.patch('app.archiver.storage.store_temperature_data',
+                        return_value="MinIO S3 error occurred: denied"):
+            self.assertIn("MinIO", self.archiver.archive_snapshot())
+
+        self.archiver.redis_client.eval.assert_not_called()
+
+    def test_archive_snapshot_upload_error(self):
+        """Upload exceptions count as failed instead of ending the scheduler thread"""
+        self.pipe.execute.return_value = ["reading\n", "1700000000", None]
+        labels = {"outcome": "failed"}
+        before = REGISTRY.get_sample_value('hivebox_archives_total', labels) or 0
+        error = urllib3.exceptions.MaxRetryError(None, "/hivebox", "connection refused")
+
+        with mock.patch('app.archiver.storage.store_temperature_data', side_effect=error):
+            self.assertIn("upload failed", self.archiver.archive_snapshot())
+
+        self.assertEqual(REGISTRY.get_sample_value('hivebox_archives_total', labels) - before, 1)
+        self.archiver.redis_client.eval.assert_not_called()
+
+    def test_archive_snapshot_lease_lost(self):
+        """A leader that lost its lease during the upload still records it, forward only"""
+        self.pipe.execute.return_value = ["reading\n", "1700000000", None]
+        # A newer snapshot was already recorded by the successor
+        self.archiver.redis_client.eval.return_value = 0
+        labels = {"outcome": "stored"}
+        before = REGISTRY.get_sample_value('hivebox_archives_total', labels) or 0
+
+        with mock.patch('app.archiver.storage.store_temperature_data',
+                        return_value="Temperature data successfully uploaded"):
+            self.archiver.archive_snapshot()
+
+        self.archiver.redis_client.eval.assert_called_once_with(
+            archiver.MARK_SCRIPT, 1, archiver.LAST_ARCHIVED_KEY, "1700000000")
+        self.assertEqual(REGISTRY.get_sample_value('hivebox_archives_total', labels) - before, 1)
+
+    def test_upload_renews_lease(self):
+        """The lease is renewed while a slow upload runs"""
+        self.archiver.lease_ttl = 0.06
+
+        def slow_upload(result, updated_at):
+            time.sleep(0.1)
+            return "Temperature data successfully uploaded"
+
+        with mock.patch('app.archiver.storage.store_temperature_data', side_effect=slow_upload), \
+             mock.patch.object(self.archiver, 'hold_lease') as mock_hold:
+            self.archiver.upload("reading\n", "1700000000")
+
+        self.assertGreaterEqual(mock_hold.call_count, 1)
+
+
 class TestStorage(unittest.TestCase):
     """Test cases for storage functionality"""
 
@@ -171,7 +1032,8 @@ class TestStorage(unittest.TestCase):
         """Set up common test data"""
         self.mock_temp_data = (
             "Average temperature: 22.5 °C (Good)\nFrom: test\n",
-            {"total_sensors": 10, "null_count": 1}
+            {"total_sensors": 10, "null_count": 1},
+            None
         )
 
     def test_store_temperature_data_success(self):
@@ -182,13 +1044,47 @@ class TestStorage(unittest.TestCase):
             mock_client.bucket_exists.return_value = True
             mock_client.list_buckets.return_value = []
 
-            with mock.patch('app.storage.opensense.get_temperature',
+            with mock.patch('app.storage.opensense.get_snapshot',
                            return_value=self.mock_temp_data):
                 result = store_temperature_data()
 
                 self.assertIn("successfully uploaded", result)
                 mock_client.put_object.assert_called_once()
 
+    def test_store_temperature_data_archives_sketch(self):
+        """Test only the sketch of the stored refresh is uploaded, named after it"""
+        member = sketches.sketch_member(sketches.TDigest().add(20), 1700000000)
+        mock_redis_client = mock.MagicMock()
+        mock_redis_client.zrangebyscore.return_value = [member]
+
+        with mock.patch('app.storage.Minio') as mock_minio_class, \
+             mock.patch('app.sketches.shared_redis_client', return_value=mock_redis_client):
+            mock_client = mock.MagicMock()
+            mock_minio_class.return_value = mock_client
+            mock_client.bucket_exists.return_value = True
+
+            store_temperature_data("reading\n", 1700000000)
+            store_temperature_data("reading\n", 1700000000)
+
+        mock_redis_client.zrangebyscore.assert_called_with(
+            sketches.SKETCH_KEY, 1700000000, 1700000000)
+        sketch_calls = [c for c in mock_client.put_object.call_args_list
+                        if c.kwargs['content_type'] == 'application/json']
+        self.assertEqual(len(sketch_calls), 2)
+        # Storing the same refresh again overwrites its sketch
+        self.assertEqual(sketch_calls[0].args[1], sketch_calls[1].args[1])
+        self.assertTrue(sketch_calls[0].args[1].startswith('sketch_1700000000_'))
+
+    def test_store_temperature_data_without_refresh_time(self):
+        """Test no sketch is uploaded when the time of the reading is unknown"""
+        with mock.patch('app.storage.Minio') as mock_minio_class, \
+             mock.patch('app.storage.sketches.of_refresh') as mock_of_refresh:
+            mock_minio_class.return_value.bucket_exists.return_value = True
+            store_temperature_data("reading\n")
+
+        mock_of_refresh.assert_not_called()
+        mock_minio_class.return_value.put_object.assert_called_once()
+
     def test_store_temperature_data_create_bucket(self):
         """Test bucket creation when it doesn't exist"""
         with mock.patch('app.storage.Minio') as mock_minio_class:
@@ -197,7 +1093,7 @@ class TestStorage(unittest.TestCase):
             mock_client.bucket_exists.return_value = False
             mock_client.list_buckets.return_value = []
 
-            with mock.patch('app.storage.opensense.get_temperature',
+            with mock.patch('app.storage.opensense.get_snapshot',
                            return_value=self.mock_temp_data):
                 result = store_temperature_data()
 
@@ -219,7 +1115,7 @@ class TestStorage(unittest.TestCase):
                 response=None
             )
 
-            with mock.patch('app.storage.opensense.get_temperature',
+            with mock.patch('app.storage.opensense.get_snapshot',
                            return_value=self.mock_temp_data):
                 result = store_temperature_data()
 
@@ -239,7 +1135,7 @@ class TestStorage(unittest.TestCase):
                 body=b"{}"
             )
 
-            with mock.patch('app.storage.opensense.get_temperature',
+            with mock.patch('app.storage.opensense.get_snapshot',
                            return_value=self.mock_temp_data):
                 result = store_temperature_data()
 
@@ -252,7 +1148,7 @@ class TestStorage(unittest.TestCase):
             mock_client = mock.MagicMock()
             mock_minio_class.return_value = mock_client
             mock_client.list_buckets.side_effect = ConnectionError("Network unreachable")
-            with mock.patch('app.storage.opensense.get_temperature',
+            with mock.patch('app.storage.opensense.get_snapshot',
                            return_value=self.mock_temp_data):
                 result = store_temperature_data()
 
@@ -400,5 +1296,245 @@ class TestReadiness(unittest.TestCase):
             self.assertEqual(result, 200)
 
 
+class TestGunicornConfig(unittest.TestCase):
+    """Test cases for the Gunicorn worker hooks"""
+
+    def test_post_fork_resets_redis_clients(self):
+        """post_fork recreates the Redis clients of every module"""
+        with mock.patch('app.opensense.reset_redis_client') as mock_opensense, \
+             mock.patch('app.readiness.reset_redis_client') as mock_readiness, \
+             mock.patch('app.config.reset_shared_redis_client') as mock_shared:
+            gunicorn_conf.post_fork(mock.MagicMock(), mock.MagicMock())
+            mock_opensense.assert_called_once()
+            mock_readiness.assert_called_once()
+            mock_shared.assert_called_once()
+
+    def test_shared_redis_client_connects_once(self):
+        """The shared client is created on first use and again only after a reset"""
+        first, second = mock.MagicMock(), mock.MagicMock()
+        config.reset_shared_redis_client()
+        with mock.patch('app.config.create_redis_client',
+                        side_effect=[(first, True), (second, True)]) as mock_create:
+            self.assertIs(config.shared_redis_client(), first)
+            self.assertIs(config.shared_redis_client(), first)
+            config.reset_shared_redis_client()
+            self.assertIs(config.shared_redis_client(), second)
+            config.reset_shared_redis_client()
+
+        self.assertEqual(mock_create.call_count, 2)
+        first.close.assert_called_once()
+
+    def test_sigterm_closes_streams(self):
+        """A graceful shutdown ends open streams before the worker drains"""
+        worker = mock.MagicMock()
+        handle_exit = worker.handle_exit
+        with mock.patch('signal.signal') as mock_signal, \
+             mock.patch('app.updates.SUBSCRIBER') as mock_subscriber:
+            gunicorn_conf.post_worker_init(worker)
+            signum, handler = mock_signal.call_args[0]
+            handler(signum, None)
+
+        self.assertEqual(signum, gunicorn_conf.signal.SIGTERM)
+        mock_subscriber.close.assert_called_once()
+        handle_exit.assert_called_once_with(signum, None)
+
+    def test_reset_redis_client_replaces_module_client(self):
+        """reset_redis_client swaps in a freshly created client"""
+        new_client = mock.MagicMock()
+        with mock.patch('app.opensense.create_redis_client',
+                        return_value=(new_client, True)), \
+             mock.patch('app.opensense.redis_client', None), \
+             mock.patch('app.opensense.REDIS_AVAILABLE', False):
+            opensense.reset_redis_client()
+            self.assertIs(opensense.redis_client, new_client)
+            self.assertTrue(opensense.REDIS_AVAILABLE)
+
+    def test_worker_exit_closes_redis_clients(self):
+        """worker_exit closes the clients that exist"""
+        mock_client = mock.MagicMock()
+        with mock.patch('app.opensense.redis_client', mock_client), \
+             mock.patch('app.readiness.redis_client', None):
+            gunicorn_conf.worker_exit(mock.MagicMock(), mock.MagicMock())
+            mock_client.close.assert_called_once()
+
+    def test_metrics_merged_across_workers(self):
+        """/metrics sums every worker and drops the live gauges of exited ones"""
+        with tempfile.TemporaryDirectory() as path, \
+             mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': path}), \
+             mock.patch.object(gunicorn_conf, 'prometheus_dir', path):
+            for pid, leader in ((101, 1), (102, 0)):
+                worker_values = values.MultiProcessValue(lambda pid=pid: pid)
+                with mock.patch('prometheus_client.values.ValueClass', worker_values):
+                    Counter('hivebox_archives', 'Archive runs', ['outcome'],
+                            registry=None).labels('stored').inc()
+                    Gauge('hivebox_archiver_leader', 'Leader', registry=None,
+                          multiprocess_mode=archiver.LEADER._multiprocess_mode).set(leader)
+
+            body = exposition.latest().decode()
+            self.assertIn('hivebox_archives_total{outcome="stored"} 2.0', body)
+            self.assertIn('hivebox_archiver_leader 1.0', body)
+
+            gunicorn_conf.child_exit(mock.MagicMock(), mock.MagicMock(pid=101))
+            body = exposition.latest().decode()
+            self.assertIn('hivebox_archives_total{outcome="stored"} 2.0', body)
+            self.assertIn('hivebox_archiver_leader 0.0', body)
+
+
+def mock_http_client(boxes=None, status_code=200, exc=None):
+    """Build an httpx client answering every request with the given boxes."""
+    def handler(request):
+        if exc is not None:
+            raise exc
+        return httpx.Response(status_code, json=boxes, request=request)
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+class TestAsyncOpenSense(unittest.IsolatedAsyncioTestCase):
+    """Test cases for the async OpenSense module"""
+
+    def setUp(self):
+        """Set up a Redis mock with an empty cache"""
+        self.mock_redis_client = mock.AsyncMock()
+        # Pipelines queue commands synchronously and only execute() is awaited
+        self.mock_redis_client.pipeline = mock.MagicMock()
+        self.pipe = self.mock_redis_client.pipeline.return_value
+        self.pipe.execute = mock.AsyncMock(return_value=[None, None, -2])
+        self.patches = [
+            mock.patch('app.async_opensense.get_redis_client',
+                       return_value=self.mock_redis_client),
+            mock.patch('builtins.print'),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        """Stop the patches"""
+        for patch in self.patches:
+            patch.stop()
+
+    async def test_fetch_and_cache(self):
+        """Readings are streamed, averaged and cached on a cache miss"""
+        boxes = MockOpenSenseResponse(40).json()
+        with mock.patch('app.async_opensense.get_http_client',
+                        return_value=mock_http_client(boxes)):
+            result, stats = await async_opensense.get_temperature()
+
+        self.assertIn('Too hot', result)
+        self.assertEqual(stats['total_sensors'], 1)
+        self.pipe.setex.assert_any_call("temperature_data", mock.ANY, result)
+        self.pipe.setex.assert_any_call("temperature_updated", mock.ANY, mock.ANY)
+        self.mock_redis_client.setex.assert_not_awaited()
+
+    async def test_cache_hit(self):
+        """Cached data is returned without any upstream call"""
+        self.pipe.execute.return_value = ["cached_result", "1700000000", 42]
+        with mock.patch('app.async_opensense.get_http_client') as mock_http:
+            result, _, info = await async_opensense.get_snapshot()
+
+        self.assertEqual(result, "cached_result")
+        self.assertEqual(info, (1700000000, 42))
+        mock_http.assert_not_called()
+
+    async def test_redis_error_falls_back_to_api(self):
+        """Redis failures do not prevent fetching fresh data"""
+        self.pipe.execute.side_effect = redis.RedisError("down")
+        with mock.patch('app.async_opensense.get_http_client',
+                        return_value=mock_http_client(MockOpenSenseResponse(20).json())):
+            result, _ = await async_opensense.get_temperature()
+
+        self.assertIn('Good', result)
+
+    async def test_timeout(self):
+        """Upstream timeouts are reported as an error message"""
+        with mock.patch('app.async_opensense.get_http_client',
+                        return_value=mock_http_client(exc=httpx.ReadTimeout("slow"))):
+            result, _ = await async_opensense.get_temperature()
+
+        self.assertEqual(result, "Error: API request timed out\n")
+
+    async def test_http_error(self):
+        """Upstream error statuses are reported as an error message"""
+        with mock.patch('app.async_opensense.get_http_client',
+                        return_value=mock_http_client([], status_code=502)):
+            result, _ = await async_opensense.get_temperature()
+
+        self.assertIn("Error: API request failed", result)
+
+
+class TestAsgiApp(unittest.IsolatedAsyncioTestCase):
+    """Test cases for the ASGI application endpoints"""
+
+    def setUp(self):
+        """Set up test client"""
+        self.client = asgi_app.test_client()
+
+    async def test_version_endpoint(self):
+        """Test version endpoint returns 200"""
+        response = await self.client.get('/version')
+        self.assertEqual(response.status_code, 200)
+
+    async def test_temperature_endpoint(self):
+        """Test temperature endpoint returns the reading and pod address"""
+        with mock.patch('app.async_opensense.get_snapshot',
+                        return_value=("Average temperature: 20.00 °C (Good)\n", {}, None)):
+            response = await self.client.get('/temperature')
+            body = await response.get_data(as_text=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Average temperature", body)
+        self.assertIn("From:", body)
+
+    async def test_store_endpoint(self):
+        """Test store endpoint uploads the async reading"""
+        with mock.patch('app.async_opensense.get_snapshot',
+                        return_value=("reading\n", {}, (1700000000, 120))), \
+             mock.patch('app.storage.store_temperature_data',
+                        return_value="successfully uploaded") as mock_store:
+            response = await self.client.get('/store')
+
+        self.assertEqual(response.status_code, 200)
+        mock_store.assert_called_once_with("reading\n", 1700000000)
+
+    async def test_quantiles_endpoint(self):
+        """Test quantiles endpoint reads the sketches through the async client"""
+        mock_redis = mock.MagicMock()
+        mock_redis.zrangebyscore = mock.AsyncMock(return_value=[])
+
+        with mock.patch('app.async_opensense.get_redis_client', return_value=mock_redis):
+            response = await self.client.get('/temperature/quantiles?window=1h&q=0.95')
+            body = await response.get_json()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, {"window": "1h", "sketches": 0, "readings": 0,
+                                "quantiles": {"p95": None}})
+
+    async def test_quantiles_merged_off_event_loop(self):
+        """Sketches are merged in a worker thread, not on the event loop"""
+        mock_redis = mock.MagicMock()
+        mock_redis.zrangebyscore = mock.AsyncMock(return_value=[])
+        merge_threads = []
+
+        def summary(*args):
+            merge_threads.append(threading.get_ident())
+            return {}
+
+        with mock.patch('app.async_opensense.get_redis_client', return_value=mock_redis), \
+             mock.patch('app.async_sketches.summary', side_effect=summary):
+            response = await self.client.get('/temperature/quantiles')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(merge_threads), 1)
+        self.assertNotEqual(merge_threads[0], threading.get_ident())
+
+    async def test_readyz_endpoint_not_ready(self):
+        """Test /readyz endpoint when service is not ready"""
+        with mock.patch('app.async_readiness.readiness_check', return_value=503):
+            response = await self.client.get('/readyz')
+            data = await response.get_json()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(data['status'], 'not ready')
+
+
 if __name__ == '__main__':
     unittest.main()